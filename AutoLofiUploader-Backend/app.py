@@ -1,35 +1,151 @@
 # app.py (version finale avec les deux architectures V1 et V2)
 
 import os
+import time
+import re
 import uuid
 import json
-import zipfile
-import requests
-import traceback
 
-from flask import Flask, request, jsonify, send_file, g
+from flask import Flask, Response, g, request, jsonify, send_file
+from werkzeug.utils import secure_filename
 from google.auth.exceptions import RefreshError
 import gspread
 
 import services
 import media
+import workers
+import task_store
+import reaper
+import zipstream
+import http_client
+import publisher
+import batches
+import image_cache
+import notifier
+import scheduler
+import logs
+import metrics
+from spool import spool_path, remove_files
 
 app = Flask(__name__)
+log = logs.get_logger("app")
+
+# --- Stockages partagés entre workers (voir task_store.py), un pour chaque architecture ---
+TASK_STORE = task_store.open_task_store("v1")     # Pour l'architecture V1
+TASK_STORE_V2 = task_store.open_task_store("v2")  # Pour la NOUVELLE architecture V2
+# Callbacks Suno déjà reçus, par (tâche Suno, callbackType) : Suno en envoie plusieurs par tâche et peut les renvoyer.
+CALLBACK_STORE = task_store.open_task_store("callbacks")
+
+# Les processus des pools (forkserver) réimportent ce module sous le nom __mp_main__ quand
+# l'application est lancée par `python app.py` : les tâches de fond ne démarrent pas chez eux.
+if __name__ != "__mp_main__":
+    # Nettoyage en tâche de fond des tâches abandonnées et des fichiers orphelins (voir reaper.py),
+    # et reprise des uploads YouTube interrompus (worker redémarré ou tué, voir publisher.py).
+    reaper.start({"v1": TASK_STORE, "v2": TASK_STORE_V2, "publish": publisher.PUBLISH_STORE, "batch": batches.BATCH_STORE,
+                  "callbacks": CALLBACK_STORE}, hooks=(publisher.resume_stalled_jobs,))
+
+# --- Traçage : chaque requête porte un trace_id (en-tête X-Trace-Id, sinon généré) ---
+# Il est enregistré avec la tâche, puis repris par les callbacks Suno, les téléchargements
+# de fond, /status et /publish (via metadata.json) : un `grep` suit une vidéo de bout en bout.
+_TRACE_ID_PATTERN = re.compile(r"[\w.-]{1,64}")
+
+@app.before_request
+def _bind_trace():
+    trace_id = request.headers.get("X-Trace-Id", "")
+    g.trace_token = logs.bind(trace_id if _TRACE_ID_PATTERN.fullmatch(trace_id) else logs.new_trace_id())
 
-# --- Stockages en mémoire, un pour chaque architecture ---
-TASK_STORE = {}     # Pour l'architecture V1
-TASK_STORE_V2 = {}  # Pour la NOUVELLE architecture V2
+@app.after_request
+def _expose_trace(response):
+    response.headers["X-Trace-Id"] = logs.current_trace_id() or ""
+    return response
+
+@app.teardown_request
+def _unbind_trace(error=None):
+    if "trace_token" in g:
+        logs.unbind(g.pop("trace_token"))
+
+def _adopt_trace(task):
+    """La suite de la requête (callback Suno, /status...) est journalisée sous le trace_id de la tâche."""
+    if task and _TRACE_ID_PATTERN.fullmatch(str(task.get("trace_id") or "")):
+        logs.bind(task["trace_id"])  # Rétabli par _unbind_trace en fin de requête
 
 # ==============================================================================
 # === V1 - ARCHITECTURE ORIGINALE (Complète, avec traitement côté serveur) =====
 # ==============================================================================
 
-# Helper pour le nettoyage après une requête (utilisé par /status/ et /v2/get_audio/)
-@app.after_request
-def call_after_request_callbacks(response):
-    for callback in getattr(g, 'after_request_callbacks', ()):
-        response = callback(response)
-    return response
+def _build_task_context(prompt_id, sheet_id, access_token, image_key, prompt_data):
+    if len(prompt_data) < 11:
+        raise IndexError("Structure de ligne incorrecte. 11 colonnes (A-K) sont attendues pour la V1.")
+    return {
+        "prompt_id": prompt_id, "sheet_id": sheet_id, "access_token": access_token,
+        "image_key": image_key, "music_description": prompt_data[1], "image_prompt": prompt_data[2],
+        "video_title": prompt_data[3], "video_description": prompt_data[4],
+        "video_tags": [tag.strip() for tag in prompt_data[5].split(',')],
+        "visibility": prompt_data[10]
+    }
+
+def _priority(data, default="normal"):
+    priority = data.get('priority', default)
+    if priority not in scheduler.PRIORITIES:
+        raise ValueError(f"Priorité invalide : '{priority}' (attendu : {', '.join(scheduler.PRIORITIES)}).")
+    return priority
+
+def _on_suno_started(store, namespace, task_id, future):
+    """Fin d'un lancement Suno différé par le scheduler : 'queued' -> 'pending' (ou 'error')."""
+    task = store.get(task_id) or {}
+    task.pop("estimated_start", None)
+    if future.exception():
+        log.error(f"❌ [{namespace.upper()}] Lancement différé de la tâche {task_id} en échec : {future.exception()}")
+        store.transition(task_id, ("queued",), {"status": "error", "message": str(future.exception()),
+                                                "trace_id": task.get("trace_id")})
+    else:
+        store.transition(task_id, ("queued",), {**task, "status": "pending", "suno_task_id": future.result(),
+                                                "suno_started_at": time.time()})
+        log.info(f"[{namespace.upper()}] Tâche '{task_id}' lancée, statut 'pending'.")
+    notifier.notify(namespace, task_id)
+
+def _start_v1_task(suno_key, task_context, callback_url, priority="normal"):
+    """
+    Lance la génération Suno d'un prompt et enregistre la tâche V1 (identifiée par l'ID Suno).
+    Si la clé a atteint sa limite de débit, la tâche est mise en file sous un ID local
+    au statut 'queued'. Renvoie (task_id, heure estimée du lancement ou None).
+    """
+    started, value = scheduler.SCHEDULER.run_or_queue(
+        "suno", suno_key, media.start_suno_generation, suno_key, task_context["music_description"], callback_url,
+        priority=priority)
+    trace_id = logs.current_trace_id()
+    if started:
+        TASK_STORE[value] = {"status": "pending", "context": task_context, "trace_id": trace_id,
+                             "suno_started_at": time.time()}
+        log.info(f"[V1] Tâche '{value}' initialisée avec le statut 'pending'.")
+        return value, None
+    task_id = str(uuid.uuid4())
+    TASK_STORE[task_id] = {"status": "queued", "context": task_context, "estimated_start": value.estimated_start,
+                           "trace_id": trace_id}
+    value.add_done_callback(lambda future: _on_suno_started(TASK_STORE, "v1", task_id, future))
+    log.info(f"[V1] Limite de débit Suno atteinte, tâche '{task_id}' en file (départ estimé dans {value.estimated_start - time.time():.0f}s).")
+    return task_id, value.estimated_start
+
+def _google_error(error, access_token):
+    """
+    Réponse à une erreur Google : seul un refus du token (401/403) fait oublier les clients et
+    feuilles en cache. Un quota dépassé (429) ou une panne (5xx) les garde : les rouvrir
+    coûterait des appels supplémentaires au moment où le quota manque.
+    """
+    if services.is_auth_error(error):
+        services.invalidate_token(access_token)
+        return jsonify({"error": "Token Google invalide ou expiré", "details": str(error)}), 401
+    status = error.response.status_code
+    if status == 429 or status >= 500:
+        return jsonify({"error": "Google Sheets temporairement indisponible", "details": str(error)}), 503, \
+            {"Retry-After": error.response.headers.get("Retry-After", "10")}
+    return jsonify({"error": "Erreur de l'API Google Sheets", "details": str(error)}), 400
+
+def _accepted(task_id, estimated_start):
+    """Réponse 202 commune au lancement d'une tâche (V1 ou V2)."""
+    if estimated_start is None:
+        return jsonify({"success": True, "status": "pending", "task_id": task_id}), 202
+    return jsonify({"success": True, "status": "queued", "task_id": task_id, "estimated_start": estimated_start}), 202
 
 @app.route('/run', methods=['POST'])
 def run_process():
@@ -43,169 +159,505 @@ def run_process():
         suno_key = data['suno_key']
         image_key = data['image_key']
 
-        print(f"📄 [V1] Lecture du prompt '{prompt_id}'...")
+        log.info(f"📄 [V1] Lecture du prompt '{prompt_id}'...", extra={"prompt_id": prompt_id})
         sheets_client = services.get_sheets_client(access_token)
-        prompt_data = services.get_prompt_from_sheet(sheets_client, sheet_id, prompt_id)
+        with metrics.timed("sheets_read"):
+            prompt_data = services.get_prompt_from_sheet(sheets_client, sheet_id, prompt_id)
+
+        task_context = _build_task_context(prompt_id, sheet_id, access_token, image_key, prompt_data)
+        return _accepted(*_start_v1_task(suno_key, task_context, request.url_root + "suno_callback", _priority(data)))
 
-        if len(prompt_data) < 11:
-            raise IndexError("Structure de ligne incorrecte. 11 colonnes (A-K) sont attendues pour la V1.")
+    except (ValueError, IndexError, IOError) as e:
+        return jsonify({"error": "Erreur de données ou de configuration", "details": str(e)}), 400
+    except (RefreshError, gspread.exceptions.APIError) as e:
+        return _google_error(e, data.get('access_token', ''))
+    except Exception as e:
+        log.exception("[V1] Erreur interne.")
+        return jsonify({"error": "Erreur interne sur le serveur", "details": str(e)}), 500
+
+
+@app.route('/run_batch', methods=['POST'])
+def run_batch():
+    """
+    Lance la génération de plusieurs prompts : liste `prompt_ids`, ou `"filter": "pending"`
+    pour toutes les lignes pas encore publiées. Les lignes sont lues en une seule requête
+    et les appels Suno partent en parallèle. Suivi de l'ensemble via /batch/<batch_id>.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Requête JSON invalide"}), 400
+    try:
+        access_token = data['access_token']
+        sheet_id = data['sheet_id']
+        suno_key = data['suno_key']
+        image_key = data['image_key']
+        prompt_ids = data.get('prompt_ids')
+        pending = data.get('filter') == 'pending'
+        priority = _priority(data, default="low")  # Un lot ne doit pas retarder les /run unitaires
+        if not pending and not isinstance(prompt_ids, list):
+            raise ValueError("Fournir une liste 'prompt_ids' ou \"filter\": \"pending\".")
 
-        task_context = {
-            "prompt_id": prompt_id, "sheet_id": sheet_id, "access_token": access_token,
-            "image_key": image_key, "music_description": prompt_data[1], "image_prompt": prompt_data[2],
-            "video_title": prompt_data[3], "video_description": prompt_data[4],
-            "video_tags": [tag.strip() for tag in prompt_data[5].split(',')],
-            "visibility": prompt_data[10]
-        }
+        sheets_client = services.get_sheets_client(access_token)
+        with metrics.timed("sheets_read"):
+            rows, missing = services.get_prompt_rows(sheets_client, sheet_id, prompt_ids, pending=pending)
+        if len(rows) > batches.BATCH_MAX_ITEMS:
+            raise ValueError(f"Trop de prompts dans le lot ({len(rows)}, maximum {batches.BATCH_MAX_ITEMS}).")
+        log.info(f"📄 [V1] Lot de {len(rows)} prompts lu depuis le Google Sheet.")
+
+        errors = {prompt_id: f"Prompt avec l'ID '{prompt_id}' non trouvé." for prompt_id in missing}
+        contexts = {}
+        for prompt_id, prompt_data in rows.items():
+            try:
+                contexts[prompt_id] = _build_task_context(prompt_id, sheet_id, access_token, image_key, prompt_data)
+            except IndexError as e:
+                errors[prompt_id] = str(e)
 
         callback_url = request.url_root + "suno_callback"
-        task_id = media.start_suno_generation(suno_key, task_context["music_description"], callback_url)
-        
-        TASK_STORE[task_id] = {"status": "pending", "context": task_context}
-        print(f"   - [V1] Tâche '{task_id}' initialisée avec le statut 'pending'.")
-        
-        return jsonify({"success": True, "status": "pending", "task_id": task_id}), 202
+        batch_id = batches.start_batch(
+            "v1", contexts, lambda prompt_id, context: _start_v1_task(suno_key, context, callback_url, priority)[0], errors)
+        return jsonify({"success": True, "status": "starting", "batch_id": batch_id,
+                        "prompt_ids": list(contexts) + list(errors)}), 202
 
-    except (ValueError, IndexError, IOError) as e:
+    except (KeyError, ValueError) as e:
         return jsonify({"error": "Erreur de données ou de configuration", "details": str(e)}), 400
     except (RefreshError, gspread.exceptions.APIError) as e:
-        return jsonify({"error": "Token Google invalide ou expiré", "details": str(e)}), 401
+        return _google_error(e, data.get('access_token', ''))
     except Exception as e:
-        traceback.print_exc()
+        log.exception("[V1] Erreur interne.")
         return jsonify({"error": "Erreur interne sur le serveur", "details": str(e)}), 500
 
 
+@app.route('/batch/<batch_id>', methods=['GET'])
+@app.route('/v2/batch/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    """Un seul appel pour l'état de toutes les tâches d'un lot (V1 ou V2)."""
+    description = _describe_batch(batch_id)
+    if not description: return jsonify({"status": "not_found"}), 404
+    return jsonify(description), 200
+
+
+@app.route('/batch/<batch_id>/events', methods=['GET'])
+@app.route('/v2/batch/<batch_id>/events', methods=['GET'])
+def stream_batch_status(batch_id):
+    """Flux SSE de tout un lot : un évènement à chaque changement, jusqu'à ce qu'aucune tâche n'attende plus."""
+    batch = batches.get_batch(batch_id)
+    if not batch: return jsonify({"status": "not_found"}), 404
+    task_ids = [entry["task_id"] for entry in batch["items"].values() if entry.get("task_id")]
+    return _event_stream(
+        lambda: notifier.sse_snapshots(batch["kind"], task_ids, lambda: _describe_batch(batch_id), _batch_settled),
+        lambda: _describe_batch(batch_id) or {"status": "not_found"})
+
+
+def _batch_settled(description):
+    return description["status"] != "starting" and not any(
+        item["status"] in notifier.WAITING_STATUSES or item["status"] == "starting" for item in description["tasks"])
+
+def _describe_batch(batch_id):
+    batch = batches.get_batch(batch_id)
+    if not batch: return None
+    store = TASK_STORE if batch["kind"] == "v1" else TASK_STORE_V2
+    tasks, counts = [], {}
+    for key, entry in batch["items"].items():
+        item = {"key": key, **entry}
+        if entry.get("task_id"):
+            task = store.get(entry["task_id"])
+            # Une tâche absente a déjà été téléchargée par le client (ou a expiré).
+            item["status"] = task.get("status", "unknown") if task else "not_found"
+            if task and task.get("message"): item["message"] = task["message"]
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+        tasks.append(item)
+    return {"batch_id": batch_id, "kind": batch["kind"], "status": batch["status"], "counts": counts, "tasks": tasks}
+
+
+def _first_delivery(namespace, suno_task_id, callback_type):
+    """Vrai pour le premier callback (tâche, type) reçu ; faux pour un doublon renvoyé par Suno."""
+    return CALLBACK_STORE.put_if_absent(f"{namespace}:{suno_task_id}:{callback_type}", {"status": "received"})
+
+def _forget_delivery(namespace, suno_task_id, callback_type):
+    """Le callback n'a pas pu être traité (503) : son renvoi par Suno ne doit pas passer pour un doublon."""
+    CALLBACK_STORE.pop(f"{namespace}:{suno_task_id}:{callback_type}", None)
+
+def _record_stream_url(store, task_id, main_data_obj):
+    """Callback intermédiaire : expose `stream_audio_url` (écoute anticipée) tant que la tâche est en attente."""
+    item = (main_data_obj.get("data") or [{}])[0]
+    task = store.get(task_id)
+    if task and item.get("stream_audio_url"):
+        store.transition(task_id, ("pending",), {**task, "stream_audio_url": item["stream_audio_url"]})
+
+def _callback_outcome(version, callback_type, outcome):
+    metrics.CALLBACKS.inc(version=version, type=callback_type or "unknown", outcome=outcome)
+
+def _observe_task_timings(timings):
+    """Durées d'un traitement de fond (voir workers.StageTimer) vers les histogrammes de /metrics."""
+    metrics.observe_stage("worker_queue_wait", timings.get("queue_wait", 0))
+    metrics.observe_timings({k: v for k, v in timings.items() if k not in ("queue_wait", "run")})
+
 @app.route('/suno_callback', methods=['POST'])
 def suno_callback():
-    print("\n🔔 [V1] Callback reçu de Suno !")
+    log.info("🔔 [V1] Callback reçu de Suno !")
     callback_data = request.get_json() or {}
-    task_id = None
+    task_id = callback_type = None
     try:
         main_data_obj = callback_data.get("data", {})
-        task_id = main_data_obj.get("task_id")
-
-        if not task_id or task_id not in TASK_STORE:
+        callback_type = main_data_obj.get("callbackType")
+        suno_task_id = task_id = main_data_obj.get("task_id")
+        # Une tâche mise en file par le scheduler est enregistrée sous un ID local.
+        if task_id and task_id not in TASK_STORE:
+            task_id = TASK_STORE.find_by_suno_id(task_id) or task_id
+
+        task = TASK_STORE.get(task_id) if task_id else None
+        if not task:
+            _callback_outcome("v1", callback_type, "unknown_task")
             return jsonify({"status": "ignored, unknown task"}), 200
-        if main_data_obj.get("callbackType") != 'complete':
-            print(f"   - [V1] Callback intermédiaire pour la tâche {task_id} ignoré.")
-            return jsonify({"status": "intermediate callback ignored"}), 200
-
-        context = TASK_STORE[task_id]["context"]
-        print(f"   - [V1] Traitement du callback final pour la tâche {task_id}.")
+        _adopt_trace(task)
+        if not _first_delivery("v1", suno_task_id, callback_type):
+            log.info(f"[V1] Callback '{callback_type}' déjà reçu pour la tâche {task_id}, doublon ignoré.")
+            _callback_outcome("v1", callback_type, "duplicate")
+            return jsonify({"status": "duplicate callback ignored"}), 200
+        if callback_type != 'complete':
+            _record_stream_url(TASK_STORE, task_id, main_data_obj)
+            if callback_type == 'first':
+                # L'image ne dépend pas de l'audio : on la génère pendant que Suno termine.
+                try:
+                    workers.POOL.submit(media.prefetch_image, task["context"]['image_key'], task["context"]['image_prompt'],
+                                        on_error=lambda error: log.warning(f"⚠️ [V1] Pré-génération de l'image de {task_id} en échec : {error}"))
+                except workers.QueueFullError:
+                    pass  # L'image sera générée avec l'audio, au callback final.
+            log.info(f"[V1] Callback intermédiaire '{callback_type}' pour la tâche {task_id} traité.")
+            _callback_outcome("v1", callback_type, "intermediate")
+            return jsonify({"status": "intermediate callback processed"}), 200
+
+        context = task["context"]
+        trace_id = task.get("trace_id")
+        log.info(f"[V1] Traitement du callback final pour la tâche {task_id}.")
+        if task.get("suno_started_at"):
+            metrics.observe_stage("suno_generation", time.time() - task["suno_started_at"])
 
         item = main_data_obj.get("data", [{}])[0]
         audio_url = item.get("audio_url") or item.get("stream_audio_url")
         if not audio_url: raise ValueError("URL audio manquante dans le callback.")
 
-        print("   - [V1] Téléchargement de l'audio...")
-        resp = requests.get(audio_url, timeout=180)
-        resp.raise_for_status()
-        audio_path = f"/tmp/{task_id}_audio.mp3"
-        with open(audio_path, "wb") as f: f.write(resp.content)
-        
-        print("   - [V1] Téléchargement de l'image...")
-        image_path = media.download_image_from_ia(context['image_key'], context['image_prompt'])
-
-        TASK_STORE[task_id] = {
-            "status": "ready_for_download",
-            "files": {"audio": audio_path, "image": image_path},
-            "metadata": {
-                "video_title": context["video_title"], "video_description": context["video_description"],
-                "video_tags": context["video_tags"], "access_token": context["access_token"],
-                "sheet_id": context["sheet_id"], "prompt_id": context["prompt_id"],
-                "visibility": context["visibility"]
-            }
-        }
-        print(f"✅ [V1] Tâche '{task_id}' mise à jour au statut 'ready_for_download'.")
-        return jsonify({"status": "callback processed successfully"}), 200
-
+        def on_done(result, timings):
+            all_timings = {**timings, **result["timings"]}
+            ready = TASK_STORE.transition(task_id, ("downloading",), {
+                "status": "ready_for_download",
+                "files": result["files"],
+                "crc32": result["crc32"],
+                "timings": all_timings,
+                "trace_id": trace_id,
+                "metadata": {
+                    "video_title": context["video_title"], "video_description": context["video_description"],
+                    "video_tags": context["video_tags"], "access_token": context["access_token"],
+                    "sheet_id": context["sheet_id"], "prompt_id": context["prompt_id"],
+                    "visibility": context["visibility"],
+                    "trace_id": trace_id  # Renvoyé par le client à /publish
+                }
+            })
+            if not ready:
+                # Tâche supprimée entre-temps (DELETE du client, TTL du reaper) : on ne la recrée pas.
+                remove_files(*result["files"].values())
+                log.info(f"[V1] Tâche {task_id} supprimée pendant le traitement, fichiers abandonnés.")
+                return
+            notifier.notify("v1", task_id)
+            _observe_task_timings(all_timings)
+            log.info(f"✅ [V1] Tâche '{task_id}' mise à jour au statut 'ready_for_download'.", extra={"timings": all_timings})
+
+        def on_error(error):
+            log.error(f"❌ [V1] Échec du traitement de fond pour la tâche {task_id}.", exc_info=error)
+            if TASK_STORE.transition(task_id, ("downloading",), {"status": "error", "message": str(error), "trace_id": trace_id}):
+                notifier.notify("v1", task_id)
+
+        # Réclamation atomique : un seul worker peut faire passer la tâche de 'pending' à 'downloading'.
+        if not TASK_STORE.transition(task_id, ("pending",), {"status": "downloading", "context": context,
+                                                             "trace_id": trace_id}):
+            log.info(f"[V1] Tâche {task_id} déjà en cours de traitement, callback ignoré.")
+            _callback_outcome("v1", callback_type, "already_processing")
+            return jsonify({"status": "already processing"}), 200
+        try:
+            workers.POOL.submit(media.prepare_v1_media, task_id, audio_url, context['image_key'], context['image_prompt'],
+                                on_done=on_done, on_error=on_error)
+        except workers.QueueFullError:
+            TASK_STORE.transition(task_id, ("downloading",), task)
+            raise
+        notifier.notify("v1", task_id)
+        log.info(f"[V1] Téléchargements confiés au pool de fond, tâche '{task_id}' au statut 'downloading'.")
+        _callback_outcome("v1", callback_type, "accepted")
+        return jsonify({"status": "callback accepted"}), 200
+
+    except workers.QueueFullError as e:
+        log.warning(f"⏳ [V1] {e} Suno devra renvoyer le callback pour la tâche {task_id}.")
+        _forget_delivery("v1", suno_task_id, callback_type)
+        _callback_outcome("v1", callback_type, "saturated")
+        return jsonify({"error": "Serveur saturé, réessayez plus tard."}), 503, {"Retry-After": str(workers.WORKER_RETRY_AFTER)}
     except Exception as e:
-        if task_id and task_id in TASK_STORE: TASK_STORE[task_id] = {"status": "error", "message": str(e)}
-        traceback.print_exc()
+        if task_id and task_id in TASK_STORE:
+            TASK_STORE[task_id] = {"status": "error", "message": str(e), "trace_id": logs.current_trace_id()}
+            notifier.notify("v1", task_id)
+        log.exception("[V1] Erreur lors du traitement du callback.")
+        _callback_outcome("v1", callback_type, "error")
         return jsonify({"error": "Erreur lors du traitement du callback V1."}), 400
 
 
+def _describe_task(task, download_url):
+    """Corps JSON d'un statut sans contenu (202, erreur, évènement SSE)."""
+    description = {"status": task.get("status", "unknown")}
+    if task.get("message"): description["message"] = task["message"]
+    if task.get("estimated_start"): description["estimated_start"] = task["estimated_start"]
+    if task.get("stream_audio_url"): description["stream_audio_url"] = task["stream_audio_url"]
+    if description["status"] in ("ready_for_download", "ready", "downloaded"): description["download_url"] = download_url
+    return description
+
+def _fetch_task(store, namespace, task_id):
+    """
+    Lit la tâche ; avec `?wait=<secondes>`, attend d'abord qu'elle quitte 'pending'/'downloading'.
+    Renvoie aussi les en-têtes de la réponse 202 : Retry-After si toutes les places d'attente
+    (NOTIFY_MAX_WAITERS) sont prises, auquel cas la tâche est lue sans attendre.
+    """
+    wait = notifier.wait_param(request.args)
+    if wait <= 0: return store.get(task_id), {}
+    if not notifier.try_reserve():
+        log.warning(f"⏳ {notifier.NOTIFY_MAX_WAITERS} requêtes déjà en attente : réponse immédiate pour {task_id}.")
+        return store.get(task_id), {"Retry-After": str(notifier.NOTIFY_RETRY_AFTER)}
+    try:
+        return notifier.wait_until_settled(store, namespace, task_id, wait), {}
+    finally:
+        notifier.release()
+
+def _event_stream(stream_fn, current_fn):
+    """
+    Réponse SSE qui occupe une place d'attente jusqu'à la fermeture de la connexion. Places
+    toutes prises : un seul évènement avec l'état actuel, Retry-After et un `retry:` SSE pour
+    que l'EventSource du navigateur se reconnecte plus tard au lieu d'occuper un thread.
+    """
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if not notifier.try_reserve():
+        log.warning(f"⏳ {notifier.NOTIFY_MAX_WAITERS} requêtes déjà en attente : flux SSE réduit à l'état actuel.")
+        headers["Retry-After"] = str(notifier.NOTIFY_RETRY_AFTER)
+        return Response(notifier.sse_busy(current_fn()), mimetype='text/event-stream', headers=headers)
+    response = Response(stream_fn(), mimetype='text/event-stream', headers=headers)
+    # Appelé par le serveur WSGI même si le flux n'a jamais été itéré (client parti avant le premier octet) ;
+    # pas de direct_passthrough, qui renverrait le générateur nu et sauterait ces callbacks.
+    response.call_on_close(notifier.release)
+    return response
+
+def _sse_response(store, namespace, task_id, download_url):
+    describe = lambda task: _describe_task(task, download_url)
+
+    def current():
+        task = store.get(task_id)
+        return describe(task) if task else {"status": "not_found"}
+
+    return _event_stream(lambda: notifier.sse_stream(store, namespace, task_id, describe), current)
+
+def _requested_range(size, etag):
+    """
+    Intervalle [début, fin) demandé par l'en-tête Range, et s'il s'agit d'une réponse partielle.
+    Range est ignoré (réponse complète) si If-Range ne correspond plus à `etag` ou s'il
+    demande plusieurs intervalles ; renvoie None si l'intervalle est hors du contenu (416).
+    """
+    byte_range, if_range = request.range, request.if_range
+    if byte_range is None or byte_range.units != 'bytes' or len(byte_range.ranges) != 1:
+        return 0, size, False
+    if (if_range.etag or if_range.date) and if_range.etag != etag:
+        return 0, size, False
+    bounds = byte_range.range_for_length(size)
+    if bounds is None:
+        return None
+    return bounds[0], bounds[1], True
+
+# Statuts dans lesquels plus rien ne tourne en fond pour la tâche : le client peut la supprimer (DELETE).
+DELETABLE_STATUSES = ("ready_for_download", "ready", "downloaded", "error")
+
+def _delete_task(store, namespace, task_id):
+    """DELETE commun à V1 et V2 : supprime la tâche et ses fichiers, sauf si un travail de fond est en cours (409)."""
+    task = store.get(task_id)
+    if not task:
+        return jsonify({"status": "not_found"}), 404
+    _adopt_trace(task)
+    if task.get("status") not in DELETABLE_STATUSES:
+        return jsonify({"status": task.get("status"), "message": "Tâche encore en cours de traitement."}), 409
+    task = store.pop(task_id, None)
+    if not task:
+        return jsonify({"status": "not_found"}), 404
+    log.info(f"🧹 [{namespace.upper()}] Nettoyage des fichiers pour la tâche {task_id}...")
+    remove_files(*reaper.task_files(task))
+    notifier.notify(namespace, task_id)
+    return jsonify({"status": "deleted"}), 200
+
 @app.route('/status/<task_id>', methods=['GET'])
 def get_task_status(task_id):
-    print(f"   - [V1] Requête de statut pour la tâche : {task_id}")
-    task = TASK_STORE.get(task_id)
+    """
+    Statut d'une tâche V1, puis le ZIP quand elle est prête. Avec `?wait=30`, la requête
+    reste ouverte jusqu'au changement de statut (long-poll) au lieu de répondre 202 tout de suite.
+    """
+    task, wait_headers = _fetch_task(TASK_STORE, "v1", task_id)
 
     if not task: return jsonify({"status": "not_found"}), 404
     status = task.get("status", "unknown")
-    if status == "pending": return jsonify({"status": "pending"}), 202
+    if status in notifier.WAITING_STATUSES: return jsonify(_describe_task(task, None)), 202, wait_headers
+    _adopt_trace(task)
+    log.info(f"[V1] Requête de statut pour la tâche : {task_id} ({status})")
     if status == "error":
         error_message = task.get("message", "Erreur inconnue.")
         TASK_STORE.pop(task_id, None)
         return jsonify({"status": "error", "message": error_message}), 500
-    if status == "ready_for_download":
-        print(f"   - [V1] La tâche {task_id} est prête. Création du ZIP...")
+    if status in ("ready_for_download", "downloaded"):
+        log.info(f"[V1] La tâche {task_id} est prête. Envoi du ZIP en streaming...")
         try:
-            audio_path = task["files"]["audio"]
-            image_path = task["files"]["image"]
-            zip_path = f"/tmp/{task_id}_bundle.zip"
-            
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                zipf.write(audio_path, arcname='audio.mp3')
-                zipf.write(image_path, arcname='image.jpg')
-                zipf.writestr('metadata.json', json.dumps(task["metadata"]))
-            
-            response = send_file(zip_path, as_attachment=True, download_name='media_bundle.zip')
-            
-            @g.after_request
-            def cleanup(resp):
-                print(f"🧹 [V1] Nettoyage des fichiers pour la tâche {task_id}...")
-                if os.path.exists(zip_path): os.remove(zip_path)
-                if os.path.exists(audio_path): os.remove(audio_path)
-                if os.path.exists(image_path): os.remove(image_path)
-                TASK_STORE.pop(task_id, None)
-                return resp
-            return response
+            files = task["files"]
+            crcs = task.get("crc32", {})
+            # ZIP_STORED : le MP3 et les JPEG sont déjà compressés, on les envoie tels quels depuis le disque.
+            arcnames = {"audio": "audio.mp3", "image": "image.jpg", "thumbnail": "thumbnail.jpg"}
+            entries = [(arcnames[name], files[name]) for name in arcnames if files.get(name)]
+            bundle = zipstream.StoredZip(
+                entries + [('metadata.json', json.dumps(task["metadata"]).encode('utf-8'))],
+                crcs={arcnames[name]: crcs.get(name) for name in arcnames})
+            headers = {"Accept-Ranges": "bytes", "ETag": f'"{bundle.etag}"',
+                       "Content-Disposition": "attachment; filename=media_bundle.zip"}
+
+            requested = _requested_range(bundle.size, bundle.etag)
+            if requested is None:
+                return Response(status=416, headers={**headers, "Content-Range": f"bytes */{bundle.size}"})
+            start, stop, partial = requested
+            if partial:
+                headers["Content-Range"] = f"bytes {start}-{stop - 1}/{bundle.size}"
+                log.info(f"[V1] Reprise du téléchargement de la tâche {task_id} à l'octet {start}.")
+
+            def generate():
+                sent_from = time.perf_counter()
+                yield from bundle.iter_range(start, stop)
+                # Atteint uniquement quand tout l'intervalle a été transmis. Comme en V2, une réponse qui
+                # va jusqu'à la fin de l'archive (complète, ou reprise d'un téléchargement interrompu)
+                # la marque 'downloaded' ; les fichiers restent disponibles jusqu'à ce que le client
+                # confirme la réception (DELETE) ou jusqu'au TTL de ce statut.
+                metrics.observe_stage("zip_stream", time.perf_counter() - sent_from)
+                if stop == bundle.size and status == "ready_for_download":
+                    TASK_STORE.transition(task_id, ("ready_for_download",), {**task, "status": "downloaded"})
+                    notifier.notify("v1", task_id)
+
+            return Response(generate(), status=206 if partial else 200, mimetype='application/zip',
+                            direct_passthrough=True, headers={**headers, "Content-Length": str(stop - start)})
         except Exception as e:
-            traceback.print_exc()
+            log.exception(f"[V1] Échec de la création du ZIP de la tâche {task_id}.")
             return jsonify({"status": "error", "message": f"Erreur lors de la création du ZIP : {e}"}), 500
     return jsonify({"status": "unknown"}), 500
 
+@app.route('/status/<task_id>', methods=['DELETE'])
+def confirm_task_download(task_id):
+    """V1 : le client confirme la réception complète du ZIP ; les fichiers sont supprimés tout de suite."""
+    return _delete_task(TASK_STORE, "v1", task_id)
+
+@app.route('/status/<task_id>/events', methods=['GET'])
+def get_task_events(task_id):
+    """Flux Server-Sent Events des changements de statut d'une tâche V1, jusqu'à 'ready_for_download' ou 'error'."""
+    return _sse_response(TASK_STORE, "v1", task_id, request.url_root + f"status/{task_id}")
+
 
 @app.route('/publish', methods=['POST'])
 def publish_video():
-    temp_files = []
+    """Enregistre la vidéo reçue et lance sa publication en tâche de fond. Suivi via /publish/<job_id>."""
+    video_path = None
     try:
         if 'video_file' not in request.files or 'metadata_str' not in request.form:
             return jsonify({"error": "Requête invalide."}), 400
 
         video_file = request.files['video_file']
         metadata = json.loads(request.form['metadata_str'])
+        missing = [k for k in ('access_token', 'video_title', 'video_description', 'video_tags', 'sheet_id', 'prompt_id') if k not in metadata]
+        if missing:
+            return jsonify({"error": "Métadonnées incomplètes.", "details": f"Clés manquantes : {missing}"}), 400
 
-        video_path = f"/tmp/{uuid.uuid4()}_{video_file.filename}"
+        _adopt_trace(metadata)  # trace_id de la tâche, repris du metadata.json du ZIP
+        video_path = spool_path(f"{uuid.uuid4()}_{secure_filename(video_file.filename)}")
         video_file.save(video_path)
-        temp_files.append(video_path)
-        print(f"📹 [V1] Vidéo reçue du client et sauvegardée à : {video_path}")
-
-        video_url = services.upload_to_youtube(
-            metadata['access_token'], video_path,
-            metadata['video_title'], metadata['video_description'], metadata['video_tags'],
-            metadata.get('visibility', 'private')
-        )
+        log.info(f"📹 [V1] Vidéo reçue du client et sauvegardée à : {video_path}")
 
-        sheets_client = services.get_sheets_client(metadata['access_token'])
-        services.update_video_url_in_sheet(sheets_client, metadata['sheet_id'], metadata['prompt_id'], video_url)
-        
-        print("✅ [V1] Publication terminée avec succès !")
-        return jsonify({"success": True, "video_url": video_url}), 200
+        job_id = publisher.enqueue(video_path, metadata)
+        log.info(f"[V1] Job de publication '{job_id}' mis en file d'attente.")
+        return jsonify({"success": True, "status": "queued", "job_id": job_id}), 202
 
+    except workers.QueueFullError as e:
+        log.warning(f"⏳ [V1] {e}")
+        remove_files(video_path)
+        return jsonify({"error": "Trop de publications en cours, réessayez plus tard."}), 503, {"Retry-After": str(workers.WORKER_RETRY_AFTER)}
     except Exception as e:
-        traceback.print_exc()
+        log.exception("[V1] Erreur lors de la publication.")
+        remove_files(video_path)
         return jsonify({"error": "Erreur lors de la publication.", "details": str(e)}), 500
-    finally:
-        print("🧹 [V1] Nettoyage du fichier vidéo temporaire...")
-        for file_path in temp_files:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+
+@app.route('/publish/<job_id>', methods=['GET'])
+def get_publish_status(job_id):
+    """Progression d'un job de publication : octets envoyés, puis URL de la vidéo."""
+    status = publisher.job_status(job_id)
+    if not status: return jsonify({"status": "not_found"}), 404
+    if status["status"] in publisher.ACTIVE_STATUSES: return jsonify(status), 202
+    if status["status"] == "error": return jsonify(status), 500
+    return jsonify({"success": True, **status}), 200
+
+@app.route('/reaper/stats', methods=['GET'])
+def reaper_stats():
+    """Compteurs du reaper de ce worker (tâches expirées, fichiers et octets libérés...)."""
+    return jsonify(reaper.stats()), 200
+
+@app.route('/http/stats', methods=['GET'])
+def http_stats():
+    """Compteurs des sessions HTTP sortantes de ce worker (requêtes, connexions ouvertes/réutilisées, tentatives)."""
+    return jsonify(http_client.stats()), 200
+
+@app.route('/image_cache/stats', methods=['GET'])
+def image_cache_stats():
+    """Succès, échecs, générations coalescées et évictions du cache d'images."""
+    return jsonify(image_cache.stats()), 200
+
+@app.route('/scheduler/stats', methods=['GET'])
+def scheduler_stats():
+    """Files d'attente et jetons disponibles par fournisseur et par clé d'API (empreinte, jamais la clé)."""
+    return jsonify(scheduler.SCHEDULER.stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Métriques de ce worker au format texte Prometheus (durées par étape, callbacks, files d'attente)."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def _scheduler_queued():
+    return [((provider,), sum(key["queued"] for key in keys.values()))
+            for provider, keys in scheduler.SCHEDULER.stats().items()]
+
+metrics.register_gauges("autolofi_pool_jobs_in_flight", "Travaux en cours ou en attente dans les pools de fond.", ("pool",),
+                        lambda: [(("callbacks",), workers.POOL.in_flight), (("publish",), publisher.PUBLISH_POOL.in_flight)])
+metrics.register_gauges("autolofi_tasks", "Enregistrements présents dans chaque stockage de tâches.", ("store",),
+                        lambda: [(("v1",), len(TASK_STORE)), (("v2",), len(TASK_STORE_V2)),
+                                 (("publish",), len(publisher.PUBLISH_STORE)), (("batch",), len(batches.BATCH_STORE))])
+metrics.register_gauges("autolofi_scheduler_queued", "Appels en attente d'un jeton, par fournisseur.", ("provider",),
+                        _scheduler_queued)
+metrics.register_gauges("autolofi_image_cache_bytes", "Octets occupés par le cache d'images (partagé entre workers).", (),
+                        lambda: [((), image_cache.stats()["bytes"])])
+metrics.register_gauges("autolofi_status_waiters", "Requêtes long-poll et SSE en attente d'un changement de statut.", (),
+                        lambda: [((), notifier.waiting())])
 
 # ==============================================================================
 # === V2 - NOUVELLE ARCHITECTURE MINIMALISTE (AUDIO SEULEMENT) =================
 # ==============================================================================
 
+def _start_v2_task(suno_key, task_id, music_description, callback_url, priority="normal"):
+    """
+    Lance la génération Suno et enregistre la tâche V2 sous l'ID choisi par le client,
+    ou la met en file ('queued') si la clé a atteint sa limite de débit.
+    Renvoie (task_id, heure estimée du lancement ou None).
+    """
+    started, value = scheduler.SCHEDULER.run_or_queue(
+        "suno", suno_key, media.start_suno_generation, suno_key, music_description, callback_url, priority=priority)
+    trace_id = logs.current_trace_id()
+    if started:
+        TASK_STORE_V2[task_id] = {"status": "pending", "suno_task_id": value, "trace_id": trace_id,
+                                  "suno_started_at": time.time()}
+        log.info(f"[V2] Tâche '{task_id}' initialisée avec le statut 'pending'.")
+        return task_id, None
+    TASK_STORE_V2[task_id] = {"status": "queued", "estimated_start": value.estimated_start, "trace_id": trace_id}
+    value.add_done_callback(lambda future: _on_suno_started(TASK_STORE_V2, "v2", task_id, future))
+    log.info(f"[V2] Limite de débit Suno atteinte, tâche '{task_id}' en file (départ estimé dans {value.estimated_start - time.time():.0f}s).")
+    return task_id, value.estimated_start
+
 @app.route('/v2/generate_audio', methods=['POST'])
 def v2_generate_audio():
     """V2 Endpoint: Lance UNIQUEMENT la génération audio."""
@@ -218,59 +670,124 @@ def v2_generate_audio():
         music_description = data['music_description']
         task_id = data['task_id']
 
-        callback_url = request.url_root + "v2/suno_callback"
-        suno_task_id = media.start_suno_generation(suno_key, music_description, callback_url)
-        
-        TASK_STORE_V2[task_id] = {"status": "pending", "suno_task_id": suno_task_id}
-        print(f"   - [V2] Tâche '{task_id}' initialisée avec le statut 'pending'.")
-
-        return jsonify({"success": True, "status": "pending", "task_id": task_id}), 202
+        return _accepted(*_start_v2_task(suno_key, task_id, music_description, request.url_root + "v2/suno_callback",
+                                         _priority(data)))
 
+    except ValueError as e:
+        return jsonify({"error": "Erreur de données ou de configuration", "details": str(e)}), 400
     except Exception as e:
-        traceback.print_exc()
+        log.exception("[V2] Erreur interne lors du lancement de la tâche audio.")
         return jsonify({"error": "Erreur interne lors du lancement de la tâche audio.", "details": str(e)}), 500
 
+@app.route('/v2/generate_audio_batch', methods=['POST'])
+def v2_generate_audio_batch():
+    """V2 Endpoint: Lance plusieurs générations audio en parallèle. Suivi via /v2/batch/<batch_id>."""
+    data = request.get_json()
+    tasks = (data or {}).get('tasks')
+    if not data or 'suno_key' not in data or not isinstance(tasks, list) \
+            or not all(isinstance(t, dict) and 'task_id' in t and 'music_description' in t for t in tasks):
+        return jsonify({"error": "Paramètres manquants : 'suno_key' et 'tasks' (liste de {'task_id', 'music_description'}) sont requis."}), 400
+    if len(tasks) > batches.BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Trop de tâches dans le lot ({len(tasks)}, maximum {batches.BATCH_MAX_ITEMS})."}), 400
+
+    try:
+        suno_key = data['suno_key']
+        priority = _priority(data, default="low")
+        callback_url = request.url_root + "v2/suno_callback"
+        descriptions = {t['task_id']: t['music_description'] for t in tasks}
+        batch_id = batches.start_batch(
+            "v2", descriptions,
+            lambda task_id, description: _start_v2_task(suno_key, task_id, description, callback_url, priority)[0])
+        return jsonify({"success": True, "status": "starting", "batch_id": batch_id, "task_ids": list(descriptions)}), 202
+
+    except ValueError as e:
+        return jsonify({"error": "Erreur de données ou de configuration", "details": str(e)}), 400
+    except Exception as e:
+        log.exception("[V2] Erreur interne lors du lancement du lot audio.")
+        return jsonify({"error": "Erreur interne lors du lancement du lot audio.", "details": str(e)}), 500
+
 @app.route('/v2/suno_callback', methods=['POST'])
 def v2_suno_callback():
     """V2 Callback: Reçoit la notification de Suno et prépare l'audio."""
-    print("\n🔔 [V2] Callback reçu de Suno !")
+    log.info("🔔 [V2] Callback reçu de Suno !")
     callback_data = request.get_json() or {}
-    suno_task_id = None
+    client_task_id = callback_type = None
     
     try:
         main_data_obj = callback_data.get("data", {})
-        if main_data_obj.get("callbackType") != 'complete':
-            return jsonify({"status": "intermediate callback ignored"}), 200
-
+        callback_type = main_data_obj.get("callbackType")
         suno_task_id = main_data_obj.get("task_id")
         if not suno_task_id:
             raise ValueError("ID de tâche Suno manquant dans le callback.")
 
-        client_task_id = next((key for key, value in TASK_STORE_V2.items() if value.get("suno_task_id") == suno_task_id), None)
-        if not client_task_id:
+        client_task_id = TASK_STORE_V2.find_by_suno_id(suno_task_id)
+        task = TASK_STORE_V2.get(client_task_id) if client_task_id else None
+        if not task:
+            _callback_outcome("v2", callback_type, "unknown_task")
             return jsonify({"status": "ignored, unknown suno task"}), 200
+        _adopt_trace(task)
+        trace_id = task.get("trace_id")
+        if not _first_delivery("v2", suno_task_id, callback_type):
+            log.info(f"[V2] Callback '{callback_type}' déjà reçu pour la tâche {client_task_id}, doublon ignoré.")
+            _callback_outcome("v2", callback_type, "duplicate")
+            return jsonify({"status": "duplicate callback ignored"}), 200
+        if callback_type != 'complete':
+            _record_stream_url(TASK_STORE_V2, client_task_id, main_data_obj)
+            _callback_outcome("v2", callback_type, "intermediate")
+            return jsonify({"status": "intermediate callback processed"}), 200
             
-        print(f"   - [V2] Traitement du callback final pour la tâche client : {client_task_id}.")
+        log.info(f"[V2] Traitement du callback final pour la tâche client : {client_task_id}.")
+        if task.get("suno_started_at"):
+            metrics.observe_stage("suno_generation", time.time() - task["suno_started_at"])
         item = main_data_obj.get("data", [{}])[0]
         audio_url = item.get("audio_url") or item.get("stream_audio_url")
         if not audio_url:
             raise ValueError("URL audio manquante dans le callback final.")
 
-        print("   - [V2] Téléchargement de l'audio...")
-        resp = requests.get(audio_url, timeout=180)
-        resp.raise_for_status()
-        audio_path = f"/tmp/{client_task_id}_audio.mp3"
-        with open(audio_path, "wb") as f: f.write(resp.content)
-
-        TASK_STORE_V2[client_task_id] = {"status": "ready", "audio_path": audio_path}
-        print(f"✅ [V2] Tâche '{client_task_id}' mise à jour au statut 'ready'.")
-        return jsonify({"status": "callback processed"}), 200
-
+        def on_done(result, timings):
+            all_timings = {**timings, **result["timings"]}
+            if not TASK_STORE_V2.transition(client_task_id, ("downloading",), {
+                    "status": "ready", "audio_path": result["audio_path"], "timings": all_timings, "trace_id": trace_id}):
+                # Tâche supprimée entre-temps (DELETE du client, TTL du reaper) : on ne la recrée pas.
+                remove_files(result["audio_path"])
+                log.info(f"[V2] Tâche {client_task_id} supprimée pendant le téléchargement, fichier abandonné.")
+                return
+            notifier.notify("v2", client_task_id)
+            _observe_task_timings(all_timings)
+            log.info(f"✅ [V2] Tâche '{client_task_id}' mise à jour au statut 'ready'.", extra={"timings": all_timings})
+
+        def on_error(error):
+            log.error(f"❌ [V2] Échec du téléchargement de fond pour la tâche {client_task_id}.", exc_info=error)
+            if TASK_STORE_V2.transition(client_task_id, ("downloading",),
+                                        {"status": "error", "message": str(error), "trace_id": trace_id}):
+                notifier.notify("v2", client_task_id)
+
+        if not TASK_STORE_V2.transition(client_task_id, ("pending",), {"status": "downloading", "suno_task_id": suno_task_id,
+                                                                       "trace_id": trace_id}):
+            log.info(f"[V2] Tâche {client_task_id} déjà en cours de traitement, callback ignoré.")
+            _callback_outcome("v2", callback_type, "already_processing")
+            return jsonify({"status": "already processing"}), 200
+        try:
+            workers.POOL.submit(media.prepare_v2_audio, client_task_id, audio_url, on_done=on_done, on_error=on_error)
+        except workers.QueueFullError:
+            TASK_STORE_V2.transition(client_task_id, ("downloading",), task)
+            raise
+        notifier.notify("v2", client_task_id)
+        log.info(f"[V2] Téléchargement confié au pool de fond, tâche '{client_task_id}' au statut 'downloading'.")
+        _callback_outcome("v2", callback_type, "accepted")
+        return jsonify({"status": "callback accepted"}), 200
+
+    except workers.QueueFullError as e:
+        log.warning(f"⏳ [V2] {e} Suno devra renvoyer le callback pour la tâche {client_task_id}.")
+        _forget_delivery("v2", suno_task_id, callback_type)
+        _callback_outcome("v2", callback_type, "saturated")
+        return jsonify({"error": "Serveur saturé, réessayez plus tard."}), 503, {"Retry-After": str(workers.WORKER_RETRY_AFTER)}
     except Exception as e:
-        if suno_task_id:
-            client_task_id = next((key for key, value in TASK_STORE_V2.items() if value.get("suno_task_id") == suno_task_id), None)
-            if client_task_id: TASK_STORE_V2[client_task_id] = {"status": "error", "message": str(e)}
-        traceback.print_exc()
+        if client_task_id:
+            TASK_STORE_V2[client_task_id] = {"status": "error", "message": str(e), "trace_id": logs.current_trace_id()}
+            notifier.notify("v2", client_task_id)
+        log.exception("[V2] Erreur lors du traitement du callback.")
+        _callback_outcome("v2", callback_type, "error")
         return jsonify({"error": "Erreur lors du traitement du callback V2."}), 400
 
 # Dans app.py
@@ -279,51 +796,64 @@ def v2_suno_callback():
 def v2_get_audio(task_id):
     """
     V2 Endpoint de Polling: Le client appelle ici pour récupérer son fichier audio.
+    Avec `?wait=30`, la requête attend le changement de statut (long-poll).
     """
-    print(f"   - [V2] Requête de statut/audio pour la tâche : {task_id}")
-    task = TASK_STORE_V2.get(task_id)
+    task, wait_headers = _fetch_task(TASK_STORE_V2, "v2", task_id)
 
     if not task:
         return jsonify({"status": "not_found"}), 404
 
     status = task.get("status", "unknown")
 
-    if status == "pending":
-        return jsonify({"status": "pending"}), 202
+    if status in notifier.WAITING_STATUSES:
+        return jsonify(_describe_task(task, None)), 202, wait_headers
+    _adopt_trace(task)
+    log.info(f"[V2] Requête de statut/audio pour la tâche : {task_id} ({status})")
     
     if status == "error":
         error_message = task.get("message", "Erreur inconnue.")
         TASK_STORE_V2.pop(task_id, None)
         return jsonify({"status": "error", "message": error_message}), 500
 
-    if status == "ready":
+    if status in ("ready", "downloaded"):
         audio_path = task.get("audio_path")
         if not audio_path or not os.path.exists(audio_path):
              return jsonify({"status": "error", "message": "Fichier audio prêt mais introuvable sur le serveur."}), 500
 
-        print(f"   - [V2] La tâche {task_id} est prête. Envoi du fichier audio.")
+        log.info(f"[V2] La tâche {task_id} est prête. Envoi du fichier audio.")
         
         try:
-            # On prépare la réponse AVANT de faire le nettoyage
-            response = send_file(audio_path, as_attachment=True, download_name='generated_audio.mp3', mimetype='audio/mpeg')
-
-            # --- DÉBUT DE LA CORRECTION ---
-            # Le nettoyage se fait après la création de la réponse, mais avant de la retourner.
-            # Pas besoin de décorateur complexe.
-            print(f"🧹 [V2] Nettoyage du fichier pour la tâche {task_id}...")
-            if os.path.exists(audio_path):
-                os.remove(audio_path)
-            TASK_STORE_V2.pop(task_id, None)
-            
+            # conditional=True : ETag, Range et If-Range (206). Une réponse complète passe par
+            # wsgi.file_wrapper, que gunicorn envoie avec sendfile (zéro copie).
+            response = send_file(audio_path, as_attachment=True, download_name='generated_audio.mp3',
+                                 mimetype='audio/mpeg', conditional=True, etag=True)
+
+            # L'envoi est fait par le serveur après notre retour : on ne sait pas s'il ira au bout.
+            # Le fichier reste donc disponible (reprise possible) jusqu'à ce que le client confirme
+            # la réception (DELETE) ou jusqu'au TTL du statut 'downloaded' (voir reaper.py).
+            content_range = response.content_range
+            if status == "ready" and request.method == 'GET' and (response.status_code == 200 or (
+                    response.status_code == 206 and content_range and content_range.stop == content_range.length)):
+                TASK_STORE_V2.transition(task_id, ("ready",), {**task, "status": "downloaded"})
+                notifier.notify("v2", task_id)
             return response
-            # --- FIN DE LA CORRECTION ---
 
         except Exception as e:
-            traceback.print_exc()
+            log.exception(f"[V2] Échec de l'envoi de l'audio de la tâche {task_id}.")
             return jsonify({"status": "error", "message": f"Erreur lors de l'envoi du fichier : {e}"}), 500
 
     return jsonify({"status": "unknown"}), 500
 
+@app.route('/v2/get_audio/<task_id>', methods=['DELETE'])
+def v2_confirm_audio(task_id):
+    """V2 : le client confirme la réception complète de l'audio ; le fichier est supprimé tout de suite."""
+    return _delete_task(TASK_STORE_V2, "v2", task_id)
+
+@app.route('/v2/get_audio/<task_id>/events', methods=['GET'])
+def v2_get_audio_events(task_id):
+    """V2 : flux Server-Sent Events des changements de statut, jusqu'à 'ready' ou 'error'."""
+    return _sse_response(TASK_STORE_V2, "v2", task_id, request.url_root + f"v2/get_audio/{task_id}")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     app.run(debug=False, host='0.0.0.0', port=port)
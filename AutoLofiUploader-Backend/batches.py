@@ -0,0 +1,58 @@
+# batches.py (lancement groupé de générations Suno)
+
+import os
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import logs
+import task_store
+
+log = logs.get_logger("batches")
+
+# --- Configuration ---
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "4"))  # Appels Suno simultanés par worker
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "200"))
+
+BATCH_STORE = task_store.open_task_store("batch")
+_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch-start")
+
+
+def start_batch(kind: str, items: dict, start_fn, errors: dict = None) -> str:
+    """
+    Enregistre un lot et lance `start_fn(clé, valeur) -> task_id` pour chaque élément
+    de `items`, au plus BATCH_CONCURRENCY à la fois, en tâche de fond.
+    `errors` : éléments déjà en échec avant le lancement (ex. prompt introuvable).
+    Le lot passe de 'starting' à 'started' quand tous les appels ont abouti ou échoué.
+    """
+    batch_id = str(uuid.uuid4())
+    entries = {key: {"status": "starting"} for key in items}
+    entries.update({key: {"status": "error", "message": message} for key, message in (errors or {}).items()})
+    remaining = [len(items)]
+    lock = threading.Lock()
+
+    def save():
+        BATCH_STORE[batch_id] = {"status": "starting" if remaining[0] else "started", "kind": kind, "items": entries}
+
+    def run(key, value):
+        try:
+            entry = {"status": "pending", "task_id": start_fn(key, value)}
+        except Exception as e:
+            log.exception(f"[Batch] Échec du lancement de '{key}' dans le lot '{batch_id}'.")
+            entry = {"status": "error", "message": str(e)}
+        with lock:
+            entries[key] = entry
+            remaining[0] -= 1
+            save()
+
+    with lock:
+        save()
+    for key, value in items.items():
+        _EXECUTOR.submit(contextvars.copy_context().run, run, key, value)
+    log.info(f"[Batch] Lot '{batch_id}' ({kind}) : {len(items)} générations lancées, {len(errors or {})} en erreur.")
+    return batch_id
+
+
+def get_batch(batch_id: str):
+    return BATCH_STORE.get(batch_id)
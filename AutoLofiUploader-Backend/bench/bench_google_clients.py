@@ -0,0 +1,64 @@
+# bench/bench_google_clients.py
+#
+# Coût de préparation des clients Google par requête (/run, /publish), avant et après
+# le cache de services.py. `open_by_key` est remplacé par une attente simulée
+# (--sheets-latency-ms) : c'est l'aller-retour réseau que le cache des feuilles évite.
+#
+#   python bench/bench_google_clients.py --requests 200 --sheets-latency-ms 150
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import gspread  # noqa: E402
+from google.oauth2.credentials import Credentials  # noqa: E402
+from googleapiclient.discovery import build  # noqa: E402
+
+import services  # noqa: E402
+
+
+class _FakeSpreadsheet:
+    sheet1 = object()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coût de préparation des clients Google, sans et avec cache.")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--sheets-latency-ms", type=float, default=150.0)
+    args = parser.parse_args()
+
+    open_calls = []
+
+    def fake_open_by_key(self, key):
+        open_calls.append(key)
+        time.sleep(args.sheets_latency_ms / 1000)
+        return _FakeSpreadsheet()
+
+    gspread.Client.open_by_key = fake_open_by_key
+    token, sheet_id = "ya29.bench-token", "bench-sheet"
+
+    def uncached():
+        client = gspread.Client(auth=Credentials(token=token))
+        client.open_by_key(sheet_id).sheet1
+        build('youtube', 'v3', credentials=Credentials(token=token, scopes=services.SCOPES_YOUTUBE))
+
+    def cached():
+        services._get_sheet(services.get_sheets_client(token), sheet_id)
+        services.get_youtube_client(token)
+
+    for name, setup in (("sans cache", uncached), ("avec cache", cached)):
+        open_calls.clear()
+        samples = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            setup()
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f"{name:>11} : moyenne {statistics.fmean(samples):8.2f} ms, médiane {statistics.median(samples):8.2f} ms, "
+              f"open_by_key appelé {len(open_calls)} fois sur {args.requests} requêtes")
+
+
+if __name__ == "__main__":
+    main()
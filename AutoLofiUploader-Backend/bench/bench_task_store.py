@@ -0,0 +1,64 @@
+# bench/bench_task_store.py
+#
+# Mesure la latence de la recherche faite par /v2/suno_callback (suno_task_id -> task_id)
+# en fonction du nombre de tâches vivantes, pour chaque implémentation de task_store.
+#
+#   python bench/bench_task_store.py                      # memory + sqlite, jusqu'à 100k tâches
+#   python bench/bench_task_store.py --redis redis://localhost:6379/15
+
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import task_store  # noqa: E402
+
+
+def _percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def bench_store(name, store, checkpoints, lookups):
+    suno_ids = []
+    print(f"\n== {name} ==")
+    print(f"{'tâches':>10} {'p50 (µs)':>10} {'p99 (µs)':>10} {'moy. (µs)':>10}")
+    for target in checkpoints:
+        while len(suno_ids) < target:
+            task_id, suno_task_id = str(uuid.uuid4()), uuid.uuid4().hex
+            store.put(task_id, {"status": "pending", "suno_task_id": suno_task_id})
+            suno_ids.append(suno_task_id)
+        samples = []
+        for suno_task_id in random.choices(suno_ids, k=lookups):
+            start = time.perf_counter()
+            found = store.find_by_suno_id(suno_task_id)
+            samples.append((time.perf_counter() - start) * 1e6)
+            assert found is not None
+        print(f"{target:>10} {_percentile(samples, 0.50):>10.1f} {_percentile(samples, 0.99):>10.1f} "
+              f"{statistics.fmean(samples):>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latence de find_by_suno_id selon le nombre de tâches.")
+    parser.add_argument("--max-tasks", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    parser.add_argument("--redis", help="URL d'un serveur Redis (compatible) à inclure dans la mesure.")
+    args = parser.parse_args()
+
+    checkpoints = [n for n in (1_000, 10_000, 100_000) if n < args.max_tasks] + [args.max_tasks]
+    bench_store("memory", task_store.MemoryTaskStore(), checkpoints, args.lookups)
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_store("sqlite (WAL)", task_store.SqliteTaskStore(os.path.join(tmp, "tasks.db"), "bench"),
+                    checkpoints, args.lookups)
+    if args.redis:
+        store = task_store.RedisTaskStore(args.redis, f"bench-{uuid.uuid4().hex[:8]}")
+        bench_store("redis", store, checkpoints, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
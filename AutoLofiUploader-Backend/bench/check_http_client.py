@@ -0,0 +1,94 @@
+# bench/check_http_client.py
+#
+# Vérifie http_client contre un serveur local (HTTP/1.1 keep-alive) qui injecte des pannes :
+#   - les requêtes successives vers le même hôte réutilisent la même connexion TCP ;
+#   - les 503 / 429 sont retentés, en respectant Retry-After ;
+#   - une requête non idempotente n'est pas retentée sur un 500.
+#
+#   python bench/check_http_client.py
+
+import os
+import sys
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("HTTP_BACKOFF_BASE", "0.05")
+import http_client  # noqa: E402
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    failures = {}  # chemin -> liste de statuts à renvoyer avant un 200
+    connections = set()
+    hits = {}
+
+    def _reply(self):
+        StubHandler.connections.add(self.client_address)
+        StubHandler.hits[self.path] = StubHandler.hits.get(self.path, 0) + 1
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        pending = StubHandler.failures.get(self.path) or []
+        status = pending.pop(0) if pending else 200
+        body = b'{"ok": true}' if status == 200 else b'{"error": "injected"}'
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    # 1. Réutilisation des connexions
+    for _ in range(20):
+        http_client.request("GET", f"{base}/ok", timeout=5).raise_for_status()
+    assert len(StubHandler.connections) == 1, f"{len(StubHandler.connections)} connexions ouvertes pour 20 requêtes"
+    m = http_client.stats()["127.0.0.1"]
+    assert m["new_connections"] == 1 and m["reused_connections"] == 19, m
+    print(f"✅ 20 requêtes, 1 connexion ouverte : {m}")
+
+    # 2. Nouvelles tentatives sur 503 puis succès
+    StubHandler.failures["/flaky"] = [503, 503]
+    response = http_client.request("POST", f"{base}/flaky", json={"inputs": "x"}, timeout=5)
+    assert response.status_code == 200 and StubHandler.hits["/flaky"] == 3
+    print("✅ 503, 503 puis 200 : réussi en 3 tentatives")
+
+    # 3. Retry-After respecté
+    StubHandler.failures["/limited"] = [429]
+    start = time.monotonic()
+    response = http_client.request("GET", f"{base}/limited", timeout=5)
+    elapsed = time.monotonic() - start
+    assert response.status_code == 200 and elapsed >= 1.0, elapsed
+    print(f"✅ 429 + Retry-After: 1 -> nouvelle tentative après {elapsed:.2f}s")
+
+    # 4. Abandon après HTTP_MAX_RETRIES
+    StubHandler.failures["/down"] = [503] * 10
+    response = http_client.request("GET", f"{base}/down", max_retries=2, timeout=5)
+    assert response.status_code == 503 and StubHandler.hits["/down"] == 3
+    print("✅ 503 persistant : abandon après 3 tentatives, dernière réponse renvoyée")
+
+    # 5. Pas de nouvelle tentative d'une requête non idempotente sur 500
+    StubHandler.failures["/generate"] = [500]
+    response = http_client.request("POST", f"{base}/generate", idempotent=False, json={}, timeout=5)
+    assert response.status_code == 500 and StubHandler.hits["/generate"] == 1
+    print("✅ POST non idempotent : 500 renvoyé sans nouvelle tentative")
+
+    print(f"Métriques finales : {http_client.stats()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
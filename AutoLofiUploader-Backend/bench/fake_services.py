@@ -0,0 +1,323 @@
+# bench/fake_services.py
+#
+# Faux Suno, HuggingFace, Google Sheets et YouTube, servis par un seul serveur HTTP local,
+# avec latence et taux d'échec réglables par service. Utilisé par bench/load_test.py ;
+# lancé seul, il affiche les variables d'environnement à donner à l'application :
+#
+#   python bench/fake_services.py --port 9000 --latency suno=0.3,generation=5 --failure-rate youtube=0.1
+#
+# Services (clés de --latency / --failure-rate) :
+#   suno        POST /api/v1/generate, puis callbacks 'text', 'first' et 'complete'
+#               envoyés à callBackUrl après `generation` secondes
+#   audio       GET  /audio/<task>.mp3 (le MP3 « généré »)
+#   huggingface POST /models/<modèle> (une image PNG)
+#   sheets      GET  /v4/spreadsheets/<id>[/values/<plage>], POST .../values:batchUpdate
+#   youtube     POST /upload/youtube/v3/videos (session d'upload résumable), PUT par morceaux
+
+import io
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from PIL import Image
+
+SERVICES = ("suno", "generation", "audio", "huggingface", "sheets", "youtube")
+DEFAULT_LATENCY = {"suno": 0.3, "generation": 3.0, "audio": 0.05, "huggingface": 1.5, "sheets": 0.15, "youtube": 0.1}
+CALLBACK_ATTEMPTS = 5  # Comme Suno, les callbacks refusés (503) sont renvoyés
+
+
+def parse_spec(spec: str) -> dict:
+    """"suno=0.3,youtube=0.1" -> {"suno": 0.3, "youtube": 0.1}"""
+    values = {}
+    for item in (spec or "").split(","):
+        name, _, value = item.partition("=")
+        if name.strip():
+            if name.strip() not in SERVICES:
+                raise ValueError(f"Service inconnu : '{name.strip()}' (attendu : {', '.join(SERVICES)}).")
+            values[name.strip()] = float(value)
+    return values
+
+
+def sheet_rows(count: int, image_prompts: int = None) -> list:
+    """En-têtes puis `count` lignes de prompts (11 colonnes A-K), comme le Google Sheet de production."""
+    image_prompts = image_prompts or count
+    rows = [["prompt_id", "music", "image", "title", "description", "tags", "video_url", "status", "", "", "visibility"]]
+    for i in range(count):
+        rows.append([f"P{i:05d}", f"lofi hip hop, pluie, piano #{i}", f"chambre au crépuscule, style anime #{i % image_prompts}",
+                     f"Lofi #{i}", f"Vidéo de test {i}", "lofi, chill, study", "", "", "", "", "private"])
+    return rows
+
+
+def _png(size: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.effect_mandelbrot((size, size), (-2.0, -1.5, 1.0, 1.5), 100).convert("RGB").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class FakeServices:
+    def __init__(self, latency: dict = None, failure_rate: dict = None, audio_bytes: int = 3 * 1024 * 1024,
+                 image_size: int = 1024, rows: list = None, port: int = 0, seed: int = None):
+        self.latency = {**DEFAULT_LATENCY, **(latency or {})}
+        self.failure_rate = failure_rate or {}
+        self.audio = random.Random(seed).randbytes(audio_bytes)
+        self.image = _png(image_size)
+        self.rows = rows if rows is not None else sheet_rows(100)
+        self.uploads = {}  # upload_id -> [octets reçus, taille annoncée]
+        self.counters = {}  # (service, "requests" | "failures") -> nombre
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), _Handler)
+        self._server.fake = self
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def env(self) -> dict:
+        """Variables d'environnement qui dirigent l'application vers ces faux services."""
+        return {"SUNO_API_URL": f"{self.url}/api/v1/generate",
+                "HUGGING_FACE_API_URL": f"{self.url}/models/black-forest-labs/FLUX.1-dev",
+                "GOOGLE_SHEETS_API_URL": f"{self.url}/",
+                "YOUTUBE_API_ROOT_URL": f"{self.url}/"}
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="fake-services", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for (service, kind), count in sorted(self.counters.items()):
+                result.setdefault(service, {})[kind] = count
+            return result
+
+    def _count(self, service: str, kind: str):
+        with self._lock:
+            self.counters[(service, kind)] = self.counters.get((service, kind), 0) + 1
+
+    def delay(self, service: str):
+        """Latence simulée (±20 %) ; renvoie True si cette requête doit échouer."""
+        with self._lock:
+            jitter = self._random.uniform(0.8, 1.2)
+            failed = self._random.random() < self.failure_rate.get(service, 0.0)
+        time.sleep(self.latency.get(service, 0.0) * jitter)
+        self._count(service, "requests")
+        if failed:
+            self._count(service, "failures")
+        return failed
+
+    def send_callbacks(self, task_id: str, callback_url: str):
+        """Ce que fait Suno une fois la génération lancée : trois callbacks, le dernier avec l'URL du MP3."""
+        audio_url = f"{self.url}/audio/{task_id}.mp3"
+        time.sleep(self.latency["generation"] * self._random.uniform(0.8, 1.2))
+        for callback_type in ("text", "first", "complete"):
+            item = {"id": task_id, "stream_audio_url": f"{audio_url}?stream=1"}
+            if callback_type == "complete":
+                item["audio_url"] = audio_url
+            body = {"code": 200, "msg": "All generated successfully.",
+                    "data": {"callbackType": callback_type, "task_id": task_id, "data": [item]}}
+            for _ in range(CALLBACK_ATTEMPTS):
+                try:
+                    response = requests.post(callback_url, json=body, timeout=30)
+                except requests.RequestException:
+                    time.sleep(1)
+                    continue
+                self._count("suno_callback", f"http_{response.status_code}")
+                if response.status_code != 503:
+                    break
+                time.sleep(min(2.0, float(response.headers.get("Retry-After") or 1)))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):  # Client parti (timeout, fermeture) : normal sous charge
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def fake(self) -> FakeServices:
+        return self.server.fake
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _reply(self, status: int, body=b"", content_type="application/json", headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _unavailable(self, google: bool = False):
+        message = "Service temporairement indisponible (échec simulé)."
+        if google:
+            # Format d'erreur des API Google, analysé par gspread (APIError) et googleapiclient (HttpError).
+            body = {"error": {"code": 503, "message": message, "status": "UNAVAILABLE"}}
+        else:
+            body = {"error": message}
+        self._reply(503, body, headers={"Retry-After": "1"})
+
+    # --- Routage ---
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path.startswith("/audio/"):
+            return self._audio()
+        if path.startswith("/v4/spreadsheets/"):
+            return self._sheets_get(path)
+        self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        if path == "/api/v1/generate":
+            return self._suno_generate()
+        if path.startswith("/models/"):
+            return self._huggingface()
+        if path.startswith("/v4/spreadsheets/") and path.endswith("/values:batchUpdate"):
+            return self._sheets_update(path)
+        if path.endswith("/youtube/v3/videos"):
+            return self._youtube_start()
+        self._body()
+        self._reply(404, {"error": "not found"})
+
+    def do_PUT(self):
+        if urlsplit(self.path).path.endswith("/youtube/v3/videos"):
+            return self._youtube_chunk()
+        self._body()
+        self._reply(404, {"error": "not found"})
+
+    # --- Suno ---
+
+    def _suno_generate(self):
+        payload = json.loads(self._body() or b"{}")
+        if self.fake.delay("suno"):
+            return self._unavailable()
+        task_id = f"fake-{uuid.uuid4().hex[:16]}"
+        threading.Thread(target=self.fake.send_callbacks, args=(task_id, payload["callBackUrl"]), daemon=True).start()
+        self._reply(200, {"code": 200, "msg": "success", "data": {"taskId": task_id}})
+
+    def _audio(self):
+        if self.fake.delay("audio"):
+            return self._unavailable()
+        self._reply(200, self.fake.audio, content_type="audio/mpeg")
+
+    # --- HuggingFace ---
+
+    def _huggingface(self):
+        self._body()
+        if self.fake.delay("huggingface"):
+            return self._reply(503, {"error": "Model is currently loading", "estimated_time": 1.0}, headers={"Retry-After": "1"})
+        self._reply(200, self.fake.image, content_type="image/png")
+
+    # --- Google Sheets ---
+
+    def _sheets_get(self, path: str):
+        if self.fake.delay("sheets"):
+            return self._unavailable(google=True)
+        parts = path.split("/")  # ['', 'v4', 'spreadsheets', <id>, 'values', <plage>]
+        if len(parts) == 4:
+            return self._reply(200, {"spreadsheetId": parts[3], "properties": {"title": "Bench", "locale": "fr_FR"},
+                                     "sheets": [{"properties": {"sheetId": 0, "title": "Feuille 1", "index": 0,
+                                                                "sheetType": "GRID",
+                                                                "gridProperties": {"rowCount": len(self.fake.rows) + 100,
+                                                                                   "columnCount": 26}}}]})
+        with self.fake._lock:
+            values = [list(row) for row in self.fake.rows]
+        self._reply(200, {"range": "'Feuille 1'!A1:K", "majorDimension": "ROWS", "values": values})
+
+    def _sheets_update(self, path: str):
+        body = json.loads(self._body() or b"{}")
+        if self.fake.delay("sheets"):
+            return self._unavailable(google=True)
+        updated = 0
+        with self.fake._lock:
+            for data in body.get("data", []):
+                match = re.search(r"([A-Z]+)(\d+)(?::[A-Z]+\d+)?$", data["range"])
+                column = ord(match.group(1)) - ord("A")
+                row = self.fake.rows[int(match.group(2)) - 1]
+                for offset, value in enumerate(data["values"][0]):
+                    row[column + offset] = value
+                    updated += 1
+        self._reply(200, {"spreadsheetId": path.split("/")[3], "totalUpdatedCells": updated})
+
+    # --- YouTube (protocole d'upload résumable) ---
+
+    def _youtube_start(self):
+        self._body()
+        if self.fake.delay("youtube"):
+            return self._unavailable(google=True)
+        upload_id = uuid.uuid4().hex
+        with self.fake._lock:
+            self.fake.uploads[upload_id] = [0, int(self.headers.get("X-Upload-Content-Length") or 0)]
+        location = f"{self.fake.url}{urlsplit(self.path).path}?uploadType=resumable&upload_id={upload_id}"
+        self._reply(200, {}, headers={"Location": location})
+
+    def _youtube_chunk(self):
+        upload_id = parse_qs(urlsplit(self.path).query).get("upload_id", [""])[0]
+        chunk = self._body()
+        with self.fake._lock:
+            upload = self.fake.uploads.get(upload_id)
+        if upload is None:
+            return self._reply(404, {"error": "Session d'upload inconnue."})
+        if self.fake.delay("youtube"):
+            return self._unavailable(google=True)
+        match = re.match(r"bytes (\*|(\d+)-(\d+))/(\d+)", self.headers.get("Content-Range", ""))
+        total = int(match.group(4))
+        with self.fake._lock:
+            if match.group(2) is not None and int(match.group(2)) == upload[0]:
+                upload[0] += len(chunk)  # Le contenu lui-même n'est pas gardé
+            received = upload[0]
+        if received >= total:
+            return self._reply(200, {"kind": "youtube#video", "id": upload_id[:11],
+                                     "status": {"uploadStatus": "uploaded"}})
+        headers = {"Range": f"bytes=0-{received - 1}"} if received else {}
+        self._reply(308, b"", headers=headers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Faux Suno, HuggingFace, Google Sheets et YouTube.")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", default="", help="Secondes par service, ex. suno=0.3,generation=5")
+    parser.add_argument("--failure-rate", default="", help="Part des requêtes en échec (503), ex. youtube=0.1")
+    parser.add_argument("--rows", type=int, default=100, help="Lignes de prompts dans le faux Google Sheet")
+    parser.add_argument("--audio-kb", type=int, default=3072)
+    args = parser.parse_args()
+
+    fake = FakeServices(parse_spec(args.latency), parse_spec(args.failure_rate), audio_bytes=args.audio_kb * 1024,
+                        rows=sheet_rows(args.rows), port=args.port).start()
+    for name, value in fake.env().items():
+        print(f"export {name}={value}")
+    print(f"ℹ️  Faux services sur {fake.url} (Ctrl+C pour arrêter)", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
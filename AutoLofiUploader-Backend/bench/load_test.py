@@ -0,0 +1,349 @@
+# bench/load_test.py
+#
+# Test de charge de bout en bout : démarre l'application sous gunicorn (comme render.yaml),
+# dirigée vers les faux services de bench/fake_services.py, puis fait tourner N tâches
+# concurrentes sur les deux architectures :
+#   - V1 : /run -> callbacks Suno -> /status (ZIP) -> DELETE -> /publish -> /publish/<job_id>
+#   - V2 : /v2/generate_audio -> callbacks Suno -> /v2/get_audio (MP3) -> DELETE
+# Rapport : latences p50/p99 par étape et de bout en bout, débit, pic de RSS (gunicorn et
+# ses workers), pic d'occupation du spool et de /tmp. `--json` écrit le rapport pour
+# comparer deux versions.
+#
+#   python bench/load_test.py --tasks 40 --concurrency 10
+#   python bench/load_test.py --flows v2 --tasks 200 --concurrency 50 --latency generation=1
+#   python bench/load_test.py --failure-rate youtube=0.2,huggingface=0.1 --json report.json
+
+import io
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import socket
+import zipfile
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_services import FakeServices, parse_spec, sheet_rows
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ACCESS_TOKEN, SHEET_ID = "ya29.load-test-token", "load-test-sheet"
+READY_TIMEOUT = 300  # Secondes au-delà desquelles une tâche est comptée en échec
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Percentile au rang le plus proche (0 si aucune valeur)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ResourceSampler:
+    """Relève périodiquement le RSS de gunicorn et de ses workers, et l'occupation du spool et de /tmp."""
+
+    def __init__(self, pid: int, spool_dir: str, interval: float = 0.2):
+        self.pid, self.spool_dir, self.interval = pid, spool_dir, interval
+        self.peak_rss = self.peak_spool = self.peak_tmp = 0
+        self._tmp_start = shutil.disk_usage(tempfile.gettempdir()).used
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _process_tree(self):
+        pids, children = [self.pid], {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                    children.setdefault(ppid, []).append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    pass
+        for pid in pids:
+            pids.extend(children.get(pid, []))
+        return pids
+
+    @staticmethod
+    def _rss(pid: int) -> int:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def _spool_bytes(self) -> int:
+        total = 0
+        for directory, _, files in os.walk(self.spool_dir):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(directory, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, sum(self._rss(pid) for pid in self._process_tree()))
+        self.peak_spool = max(self.peak_spool, self._spool_bytes())
+        self.peak_tmp = max(self.peak_tmp, shutil.disk_usage(tempfile.gettempdir()).used - self._tmp_start)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class LoadDriver:
+    def __init__(self, app_url: str, args):
+        self.app_url, self.args = app_url, args
+        self.video = os.urandom(args.video_kb * 1024)
+        self._local = threading.local()
+
+    @property
+    def http(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _suno_key(self, n: int) -> str:
+        return f"suno-key-{n % self.args.api_keys}"
+
+    def _post(self, url: str, result: dict, **kwargs) -> requests.Response:
+        """POST qui respecte, comme un vrai client, les 503 + Retry-After de l'application saturée."""
+        deadline = time.monotonic() + READY_TIMEOUT
+        while True:
+            response = self.http.post(url, timeout=120, **kwargs)
+            if response.status_code != 503 or time.monotonic() > deadline:
+                return response
+            result["retries"] += 1
+            time.sleep(float(response.headers.get("Retry-After") or 1))
+
+    def _wait_for_content(self, url: str) -> requests.Response:
+        """Long-poll (?wait=) jusqu'à ce que la tâche ne soit plus en attente ; renvoie la réponse finale."""
+        deadline = time.monotonic() + READY_TIMEOUT
+        while time.monotonic() < deadline:
+            response = self.http.get(url, params={"wait": 30}, stream=True, timeout=60)
+            if response.status_code != 202:
+                return response
+            response.close()
+            # Places d'attente du serveur toutes prises : 202 immédiat avec Retry-After.
+            if response.headers.get("Retry-After"):
+                time.sleep(float(response.headers["Retry-After"]))
+        raise TimeoutError(f"Tâche toujours en attente après {READY_TIMEOUT}s : {url}")
+
+    def run_v1(self, n: int) -> dict:
+        timings, started = {}, time.perf_counter()
+        result = {"timings": timings, "retries": 0}
+
+        def step(name, since):
+            timings[name] = time.perf_counter() - since
+            return time.perf_counter()
+
+        t = time.perf_counter()
+        response = self._post(f"{self.app_url}/run", result, json={
+            "access_token": ACCESS_TOKEN, "sheet_id": SHEET_ID, "prompt_id": f"P{n:05d}",
+            "suno_key": self._suno_key(n), "image_key": "hf-load-test"})
+        if response.status_code != 202:
+            raise RuntimeError(f"/run : HTTP {response.status_code} {response.text[:200].strip()}")
+        task_id = response.json()["task_id"]
+        t = step("run", t)
+
+        response = self._wait_for_content(f"{self.app_url}/status/{task_id}")
+        t = step("wait_ready", t)
+        if response.status_code != 200:
+            raise RuntimeError(f"/status : HTTP {response.status_code} {response.text[:200].strip()}")
+        bundle = response.content
+        with zipfile.ZipFile(io.BytesIO(bundle)) as archive:
+            metadata = json.loads(archive.read("metadata.json"))
+        self.http.delete(f"{self.app_url}/status/{task_id}", timeout=30)
+        t = step("zip_download", t)
+
+        response = self._post(f"{self.app_url}/publish", result, data={"metadata_str": json.dumps(metadata)},
+                              files={"video_file": ("video.mp4", self.video, "video/mp4")})
+        if response.status_code != 202:
+            raise RuntimeError(f"/publish : HTTP {response.status_code} {response.text[:200].strip()}")
+        job_id = response.json()["job_id"]
+        t = step("publish_upload", t)
+
+        deadline = time.monotonic() + READY_TIMEOUT
+        while True:
+            response = self.http.get(f"{self.app_url}/publish/{job_id}", timeout=30)
+            if response.status_code != 202 or time.monotonic() > deadline:
+                break
+            time.sleep(0.2)
+        step("publish_job", t)
+        if response.status_code != 200:
+            raise RuntimeError(f"/publish/{job_id} : HTTP {response.status_code} {response.text[:200].strip()}")
+        timings["total"] = time.perf_counter() - started
+        return {**result, "bytes": len(bundle)}
+
+    def run_v2(self, n: int) -> dict:
+        timings, started = {}, time.perf_counter()
+        task_id = f"load-{uuid.uuid4().hex[:12]}"
+        response = self.http.post(f"{self.app_url}/v2/generate_audio", timeout=60, json={
+            "suno_key": self._suno_key(n), "music_description": f"lofi #{n}", "task_id": task_id})
+        if response.status_code != 202:
+            raise RuntimeError(f"/v2/generate_audio : HTTP {response.status_code} {response.text[:200].strip()}")
+        timings["generate_audio"] = time.perf_counter() - started
+
+        t = time.perf_counter()
+        response = self._wait_for_content(f"{self.app_url}/v2/get_audio/{task_id}")
+        timings["wait_ready"] = time.perf_counter() - t
+        if response.status_code != 200:
+            raise RuntimeError(f"/v2/get_audio : HTTP {response.status_code} {response.text[:200].strip()}")
+        t = time.perf_counter()
+        size = len(response.content)
+        timings["audio_download"] = time.perf_counter() - t
+        self.http.delete(f"{self.app_url}/v2/get_audio/{task_id}", timeout=30)
+        timings["total"] = time.perf_counter() - started
+        return {"timings": timings, "retries": 0, "bytes": size}
+
+    def run_flow(self, flow: str) -> dict:
+        run = self.run_v1 if flow == "v1" else self.run_v2
+        results, errors = [], []
+
+        def one(n):
+            try:
+                results.append(run(n))
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as executor:
+            list(executor.map(one, range(self.args.tasks)))
+        elapsed = time.perf_counter() - started
+
+        steps = {}
+        for result in results:
+            for name, seconds in result["timings"].items():
+                steps.setdefault(name, []).append(seconds)
+        return {"tasks": self.args.tasks, "completed": len(results), "failed": len(errors), "errors": errors[:10],
+                "elapsed_s": round(elapsed, 2), "throughput_per_s": round(len(results) / elapsed, 3),
+                "bytes_served": sum(r["bytes"] for r in results),
+                "retries_after_503": sum(r["retries"] for r in results),
+                "latency_s": {name: {"p50": round(percentile(v, 0.50), 3), "p99": round(percentile(v, 0.99), 3),
+                                     "max": round(max(v), 3)} for name, v in steps.items()}}
+
+
+def start_app(fake: FakeServices, workdir: str, args) -> (subprocess.Popen, str):
+    port = _free_port()
+    env = {**os.environ, **fake.env(),
+           "SPOOL_DIR": os.path.join(workdir, "spool"),
+           "TASK_STORE_URL": f"sqlite:///{os.path.join(workdir, 'tasks.db')}",
+           "SCHEDULER_LIMITS": args.scheduler_limits,
+           "LOG_LEVEL": args.log_level,
+           "HTTP_BACKOFF_BASE": "0.2", "HTTP_BACKOFF_MAX": "2"}
+    command = [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(args.workers),
+               "--worker-class", "gthread", "--threads", str(args.threads), "--timeout", "300", "app:app"]
+    log_file = open(os.path.join(workdir, "app.log"), "wb")
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn s'est arrêté au démarrage, voir {log_file.name}")
+        try:
+            if requests.get(f"{url}/metrics", timeout=2).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("L'application n'a pas démarré en 60s.")
+
+
+def print_report(report: dict):
+    for flow, result in report["flows"].items():
+        print(f"\n=== {flow.upper()} : {result['completed']}/{result['tasks']} tâches réussies en {result['elapsed_s']}s "
+              f"({result['throughput_per_s']} tâches/s, {result['bytes_served'] / 1024 / 1024:.1f} Mo servis, "
+              f"{result['retries_after_503']} requêtes renvoyées après un 503)")
+        print(f"    {'étape':<16}{'p50 (s)':>10}{'p99 (s)':>10}{'max (s)':>10}")
+        for name, latency in result["latency_s"].items():
+            print(f"    {name:<16}{latency['p50']:>10.3f}{latency['p99']:>10.3f}{latency['max']:>10.3f}")
+        for error in result["errors"]:
+            print(f"    ❌ {error}")
+    resources = report["resources"]
+    print(f"\nLignes du faux Google Sheet marquées 'Publié' : {report['sheet_rows_published']}")
+    print(f"\nPic de RSS (gunicorn + workers) : {resources['peak_rss_mb']} Mo")
+    print(f"Pic du spool : {resources['peak_spool_mb']} Mo ; pic d'occupation de /tmp : {resources['peak_tmp_mb']} Mo")
+    print(f"Faux services : {json.dumps(report['fake_services'], ensure_ascii=False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de bout en bout contre des faux services.")
+    parser.add_argument("--flows", default="v1,v2", help="Architectures à tester, dans l'ordre")
+    parser.add_argument("--tasks", type=int, default=20, help="Tâches par architecture")
+    parser.add_argument("--concurrency", type=int, default=10, help="Tâches menées en parallèle par le client")
+    parser.add_argument("--latency", default="", help="Secondes par service, ex. generation=5,huggingface=2")
+    parser.add_argument("--failure-rate", default="", help="Part des requêtes en échec (503), ex. youtube=0.1")
+    parser.add_argument("--audio-kb", type=int, default=3072, help="Taille du MP3 « généré »")
+    parser.add_argument("--video-kb", type=int, default=5120, help="Taille de la vidéo envoyée à /publish")
+    parser.add_argument("--image-prompts", type=int, default=0, help="Prompts d'image distincts (0 = un par tâche)")
+    parser.add_argument("--api-keys", type=int, default=1, help="Clés Suno distinctes (voir scheduler.py)")
+    parser.add_argument("--scheduler-limits", default="suno=50/50,huggingface=50/50")
+    parser.add_argument("--workers", type=int, default=1, help="Workers gunicorn")
+    parser.add_argument("--threads", type=int, default=32, help="Threads par worker gunicorn")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="Écrit aussi le rapport dans ce fichier")
+    parser.add_argument("--keep", action="store_true", help="Garde le répertoire de travail (journal app.log, spool)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="autolofi-load-")
+    fake = FakeServices(parse_spec(args.latency), parse_spec(args.failure_rate), audio_bytes=args.audio_kb * 1024,
+                        rows=sheet_rows(args.tasks, args.image_prompts or None), seed=args.seed).start()
+    process, app_url = start_app(fake, workdir, args)
+    sampler = ResourceSampler(process.pid, os.path.join(workdir, "spool")).start()
+    try:
+        driver = LoadDriver(app_url, args)
+        flows = {flow: driver.run_flow(flow) for flow in args.flows.split(",") if flow}
+    finally:
+        sampler.stop()
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        fake.stop()
+
+    published = sum(1 for row in fake.rows[1:] if row[7] == "Publié")
+    report = {"args": vars(args), "flows": flows, "sheet_rows_published": published,
+              "resources": {"peak_rss_mb": round(sampler.peak_rss / 1024 / 1024, 1),
+                            "peak_spool_mb": round(sampler.peak_spool / 1024 / 1024, 1),
+                            "peak_tmp_mb": round(max(0, sampler.peak_tmp) / 1024 / 1024, 1)},
+              "fake_services": fake.stats()}
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.keep:
+        print(f"Répertoire de travail conservé : {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if any(result["failed"] for result in flows.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+# http_client.py (sessions HTTP partagées, avec pool de connexions et nouvelles tentatives)
+
+import os
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import logs
+import metrics
+
+log = logs.get_logger("http")
+
+# --- Configuration ---
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "10"))         # Connexions gardées ouvertes par hôte
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", "0.5"))      # Secondes, doublées à chaque tentative
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", "30"))
+HTTP_RETRY_AFTER_MAX = float(os.environ.get("HTTP_RETRY_AFTER_MAX", "60"))  # Au-delà, on abandonne plutôt que d'attendre
+
+# Taille du pool par hôte, ex. "api-inference.huggingface.co=8,apibox.erweima.ai=4".
+HTTP_POOL_SIZES = {
+    host.strip(): int(size)
+    for host, _, size in (item.partition("=") for item in os.environ.get("HTTP_POOL_SIZES", "").split(",") if "=" in item)
+}
+
+# Statuts qui justifient une nouvelle tentative. Pour une requête non idempotente
+# (ex. lancement d'une génération Suno), seuls ceux qui garantissent que le serveur
+# n'a rien traité sont retentés.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_STATUSES_NON_IDEMPOTENT = (429, 503)
+
+# Compteurs par hôte de ce worker, exposés par /metrics et /http/stats.
+_COUNTERS = {
+    "requests": metrics.Counter("autolofi_http_requests_total", "Requêtes HTTP sortantes, tentatives comprises.", ("host",)),
+    "new_connections": metrics.Counter("autolofi_http_new_connections_total",
+                                       "Connexions ouvertes (les autres requêtes réutilisent une connexion du pool).",
+                                       ("host",)),
+    "retries": metrics.Counter("autolofi_http_retries_total", "Nouvelles tentatives après une erreur transitoire.", ("host",)),
+    "failures": metrics.Counter("autolofi_http_failures_total", "Requêtes abandonnées après la dernière tentative.", ("host",)),
+}
+_sessions = {}
+_sessions_lock = threading.Lock()
+_sessions_pid = os.getpid()
+
+
+def _count(host: str, **increments):
+    for key, value in increments.items():
+        _COUNTERS[key].inc(value, host=host)
+
+
+def stats() -> dict:
+    """Compteurs par hôte ; `reused_connections` = requêtes servies sans ouvrir de nouvelle connexion."""
+    hosts = {host for counter in _COUNTERS.values() for (host,) in counter.values()}
+    result = {}
+    for host in sorted(hosts):
+        counts = {key: int(counter.value(host=host)) for key, counter in _COUNTERS.items()}
+        result[host] = {**counts, "reused_connections": max(0, counts["requests"] - counts["new_connections"])}
+    return result
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _count(self.host, new_connections=1)
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _count(self.host, new_connections=1)
+        return super()._new_conn()
+
+
+class _CountingAdapter(HTTPAdapter):
+    """Adaptateur requests qui compte les connexions réellement ouvertes."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _CountingHTTPConnectionPool,
+                                                   "https": _CountingHTTPSConnectionPool}
+
+
+def get_session(host: str) -> requests.Session:
+    """Session keep-alive dédiée à un hôte, créée une fois par processus."""
+    global _sessions_pid
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():  # Après un fork (gunicorn), on ne réutilise pas les sockets du parent.
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        session = _sessions.get(host)
+        if session is None:
+            pool_size = HTTP_POOL_SIZES.get(host, HTTP_POOL_MAXSIZE)
+            adapter = _CountingAdapter(pool_connections=1, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[host] = session
+        return session
+
+
+def _retry_after(response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _backoff(attempt: int) -> float:
+    """Backoff exponentiel avec « full jitter »."""
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def request(method: str, url: str, idempotent: bool = True, max_retries: int = HTTP_MAX_RETRIES, **kwargs) -> requests.Response:
+    """
+    Envoie une requête via la session partagée de l'hôte, en retentant les erreurs
+    transitoires (statuts RETRY_STATUSES, erreurs réseau) avec un backoff exponentiel
+    qui respecte l'en-tête Retry-After. Renvoie la dernière réponse obtenue, même en
+    erreur : c'est à l'appelant d'appeler `raise_for_status()`.
+    """
+    host = urlsplit(url).hostname or ""
+    session = get_session(host)
+    retry_statuses = RETRY_STATUSES if idempotent else RETRY_STATUSES_NON_IDEMPOTENT
+    retry_errors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout) if idempotent \
+        else (requests.exceptions.ConnectTimeout,)
+
+    attempt = 0
+    while True:
+        _count(host, requests=1)
+        try:
+            response = session.request(method, url, **kwargs)
+        except retry_errors as e:
+            if attempt >= max_retries:
+                _count(host, failures=1)
+                raise
+            delay = _backoff(attempt)
+            log.warning(f"[HTTP] {method} {host} : erreur réseau ({type(e).__name__}), nouvelle tentative dans {delay:.1f}s.")
+        else:
+            if response.status_code not in retry_statuses:
+                return response
+            retry_after = _retry_after(response)
+            if attempt >= max_retries or (retry_after is not None and retry_after > HTTP_RETRY_AFTER_MAX):
+                _count(host, failures=1)
+                return response
+            delay = retry_after + random.uniform(0, HTTP_BACKOFF_BASE) if retry_after is not None else _backoff(attempt)
+            log.warning(f"[HTTP] {method} {host} : statut {response.status_code}, nouvelle tentative dans {delay:.1f}s.")
+            response.close()
+        attempt += 1
+        _count(host, retries=1)
+        time.sleep(delay)
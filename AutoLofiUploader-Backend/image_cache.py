@@ -0,0 +1,154 @@
+# image_cache.py (cache disque des images de couverture, adressé par contenu)
+
+import os
+import uuid
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+import logs
+import metrics
+from spool import SPOOL_DIR, spool_path, remove_files
+
+log = logs.get_logger("image_cache")
+
+# --- Configuration ---
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", os.path.join(SPOOL_DIR, "image_cache"))
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))  # 0 = cache désactivé
+
+# Compteurs de ce worker, exposés par /metrics et /image_cache/stats.
+_COUNTERS = {
+    "hits": metrics.Counter("autolofi_image_cache_hits_total", "Images servies depuis le cache."),
+    "misses": metrics.Counter("autolofi_image_cache_misses_total", "Images absentes du cache, donc générées."),
+    "coalesced": metrics.Counter("autolofi_image_cache_coalesced_total",
+                                 "Demandes servies par la génération concurrente de la même image."),
+    "evictions": metrics.Counter("autolofi_image_cache_evictions_total", "Images évincées du cache (LRU)."),
+    "evicted_bytes": metrics.Counter("autolofi_image_cache_evicted_bytes_total", "Octets évincés du cache."),
+}
+
+
+def _count(**increments):
+    for key, value in increments.items():
+        _COUNTERS[key].inc(value)
+
+
+def stats() -> dict:
+    """Compteurs de ce worker, plus l'occupation actuelle du cache (partagé entre workers)."""
+    result = {key: int(counter.value()) for key, counter in _COUNTERS.items()}
+    entries = _entries()
+    result.update(entries=len(entries), bytes=sum(size for _, size, _ in entries), max_bytes=IMAGE_CACHE_MAX_BYTES)
+    return result
+
+
+def cache_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def _lock_path(key: str) -> str:
+    return os.path.join(IMAGE_CACHE_DIR, f"{key}.lock")
+
+
+@contextmanager
+def _key_lock(key: str, blocking: bool = True):
+    """
+    Verrou fcntl par clé : coalesce les générations concurrentes de la même image,
+    entre threads comme entre workers gunicorn. Renvoie (acquis, a_dû_attendre).
+    Le fichier de verrou est supprimé avec l'entrée : un processus qui l'a obtenu sur
+    un fichier déjà supprimé recommence sur le nouveau.
+    """
+    lock_path = _lock_path(key)
+    waited = False
+    while True:
+        with open(lock_path, "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if not blocking:
+                    yield False, True
+                    return
+                waited = True
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    current = os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path))
+                except FileNotFoundError:
+                    current = False
+                if current:
+                    yield True, waited
+                    return
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _entries():
+    """(clé, taille, dernier accès) des images en cache."""
+    try:
+        with os.scandir(IMAGE_CACHE_DIR) as it:
+            return [(entry.name[:-len(".img")], st.st_size, st.st_mtime)
+                    for entry in it if entry.name.endswith(".img")
+                    for st in (entry.stat(),)]
+    except FileNotFoundError:
+        return []
+
+
+def _evict(keep: str):
+    """Supprime les entrées les moins récemment utilisées jusqu'à repasser sous IMAGE_CACHE_MAX_BYTES."""
+    entries = sorted(_entries(), key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in entries)
+    for key, size, _ in entries:
+        if total <= IMAGE_CACHE_MAX_BYTES:
+            break
+        if key == keep:
+            continue
+        with _key_lock(key, blocking=False) as (acquired, _):
+            if not acquired:
+                continue  # Entrée en cours d'utilisation
+            remove_files(os.path.join(IMAGE_CACHE_DIR, f"{key}.img"), _lock_path(key))
+        total -= size
+        _count(evictions=1, evicted_bytes=size)
+
+
+def _hand_out(cached_path: str) -> str:
+    """Copie de travail dans le spool (lien physique : aucune copie de données) que l'appelant peut supprimer."""
+    path = spool_path(f"{uuid.uuid4()}.img")
+    try:
+        os.link(cached_path, path)
+    except OSError:
+        shutil.copyfile(cached_path, path)
+    return path
+
+
+def fetch(model: str, prompt: str, generate_fn) -> str:
+    """
+    Renvoie le chemin d'une image pour (model, prompt) dans le spool. En cas d'absence
+    du cache, appelle `generate_fn(chemin_de_destination)` une seule fois, même si
+    plusieurs requêtes demandent la même image au même moment.
+    """
+    if IMAGE_CACHE_MAX_BYTES <= 0:
+        path = spool_path(f"{uuid.uuid4()}.img")
+        generate_fn(path)
+        return path
+
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    key = cache_key(model, prompt)
+    cached_path = os.path.join(IMAGE_CACHE_DIR, f"{key}.img")
+    with _key_lock(key) as (_, waited):
+        if os.path.exists(cached_path):
+            os.utime(cached_path)  # LRU : mtime = dernier accès
+            _count(hits=1, coalesced=1 if waited else 0)
+            log.info(f"🖼️ Image trouvée dans le cache ({key[:12]}).")
+            return _hand_out(cached_path)
+        _count(misses=1)
+        tmp_path = f"{cached_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            generate_fn(tmp_path)
+            os.replace(tmp_path, cached_path)
+        except BaseException:
+            remove_files(_lock_path(key))  # Pas d'entrée : le verrou ne doit pas rester sur le disque
+            raise
+        finally:
+            remove_files(tmp_path)
+        path = _hand_out(cached_path)
+    _evict(keep=key)
+    return path
@@ -0,0 +1,97 @@
+# imaging.py (mise au format de l'image de couverture avec Pillow)
+
+import os
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+
+from spool import spool_path, remove_files
+
+# --- Configuration ---
+IMAGE_FRAME = (1920, 1080)           # Cadre 16:9 du rendu vidéo
+IMAGE_THUMBNAIL_SIZE = (1280, 720)   # Miniature YouTube
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_THUMBNAIL = os.environ.get("IMAGE_THUMBNAIL", "0").lower() in ("1", "true", "yes")
+IMAGE_PROCESS_WORKERS = int(os.environ.get("IMAGE_PROCESS_WORKERS", "2"))  # 0 = dans le thread appelant
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _render(src_path: str, dest_path: str, size: tuple, quality: int):
+    """Recadre au centre sur `size` (sans déformer) et enregistre en JPEG progressif."""
+    with Image.open(src_path) as img:
+        img.draft("RGB", size)  # JPEG : décodage directement à une résolution réduite si possible
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        frame = ImageOps.fit(img, size, Image.Resampling.LANCZOS)
+        frame.save(dest_path, "JPEG", quality=quality, optimize=True, progressive=True)
+
+
+def _process(src_path: str, outputs: dict, quality: int):
+    """Exécuté dans le pool de processus : `outputs` associe un nom de variante à son chemin."""
+    _render(src_path, outputs["image"], IMAGE_FRAME, quality)
+    if "thumbnail" in outputs:
+        # La miniature part de l'image déjà au cadre : moins de pixels à décoder.
+        _render(outputs["image"], outputs["thumbnail"], IMAGE_THUMBNAIL_SIZE, quality)
+
+
+def _get_pool():
+    # Création paresseuse : chaque worker gunicorn (après fork) obtient son propre pool.
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # forkserver, pas fork : le worker gthread a des dizaines de threads (verrous possiblement
+            # tenus au moment du fork) et des sockets clients que les enfants garderaient ouverts.
+            _pool = ProcessPoolExecutor(max_workers=IMAGE_PROCESS_WORKERS,
+                                        mp_context=multiprocessing.get_context("forkserver"))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _reset_pool(broken):
+    """Abandonne un pool dont un processus est mort (OOM...) : le prochain appel en crée un neuf."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_in_pool(*args):
+    pool = _get_pool()
+    try:
+        return pool.submit(_process, *args).result()
+    except BrokenProcessPool:
+        _reset_pool(pool)
+        return _get_pool().submit(_process, *args).result()  # Une seule nouvelle tentative
+
+
+def prepare_cover(src_path: str, task_id: str) -> dict:
+    """
+    Met l'image brute du modèle au cadre de la vidéo (et produit la miniature si
+    IMAGE_THUMBNAIL), puis supprime `src_path`. Le décodage et l'encodage tournent
+    dans un pool de processus pour ne pas occuper les threads des callbacks.
+    Renvoie {"image": chemin[, "thumbnail": chemin]}.
+    """
+    suffix = uuid.uuid4().hex[:8]
+    outputs = {"image": spool_path(f"{task_id}_{suffix}_image.jpg")}
+    if IMAGE_THUMBNAIL:
+        outputs["thumbnail"] = spool_path(f"{task_id}_{suffix}_thumbnail.jpg")
+    try:
+        if IMAGE_PROCESS_WORKERS > 0:
+            _run_in_pool(src_path, outputs, IMAGE_JPEG_QUALITY)
+        else:
+            _process(src_path, outputs, IMAGE_JPEG_QUALITY)
+    except Exception as e:
+        remove_files(*outputs.values())
+        raise IOError(f"L'image reçue n'a pas pu être traitée : {e}") from e
+    finally:
+        remove_files(src_path)
+    return outputs
@@ -0,0 +1,137 @@
+# logs.py (journaux structurés, écrits par un thread dédié, et identifiants de trace)
+
+import os
+import sys
+import copy
+import json
+import time
+import uuid
+import zlib
+import queue
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+# --- Configuration ---
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")                   # "json" ou "text"
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))  # Part des traces dont les messages INFO/DEBUG sont gardés
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+# Attributs standard d'un LogRecord : tout le reste vient de `extra=` et devient un champ du JSON.
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id"}
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id):
+    """Associe `trace_id` à tous les messages émis dans ce bloc (même thread ou contexte)."""
+    token = _trace_id.set(trace_id)
+    try:
+        yield trace_id
+    finally:
+        _trace_id.reset(token)
+
+
+def bind(trace_id):
+    """Comme `trace`, mais sans bloc (hooks de requête Flask) : renvoie le jeton à passer à `unbind`."""
+    return _trace_id.set(trace_id)
+
+
+def unbind(token):
+    _trace_id.reset(token)
+
+
+def _sampled(trace_id) -> bool:
+    if LOG_SAMPLE_RATE >= 1:
+        return True
+    if trace_id:
+        # Décision stable par trace : une requête est journalisée en entier ou pas du tout.
+        return zlib.crc32(trace_id.encode("utf-8")) / 0xFFFFFFFF < LOG_SAMPLE_RATE
+    return random.random() < LOG_SAMPLE_RATE
+
+
+class _ContextFilter(logging.Filter):
+    """Exécuté dans le thread appelant : ajoute le trace_id et applique l'échantillonnage."""
+
+    def filter(self, record):
+        record.trace_id = _trace_id.get()
+        return record.levelno >= logging.WARNING or _sampled(record.trace_id)
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"ts": round(record.created, 3), "level": record.levelname, "logger": record.name,
+                 "msg": record.getMessage()}
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_ATTRIBUTES})
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record):
+        trace_id = getattr(record, "trace_id", None)
+        line = f"{time.strftime('%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} " \
+               f"{f'[{trace_id}] ' if trace_id else ''}{record.getMessage()}"
+        return f"{line}\n{record.exc_text}" if record.exc_text else line
+
+
+class _AsyncHandler(QueueHandler):
+    """
+    Met les messages en file ; un thread les écrit sur stdout, pour qu'une écriture
+    lente (pipe plein, disque) ne bloque jamais une requête. Le thread d'écriture
+    est (re)démarré dans chaque processus, y compris après le fork de gunicorn.
+    """
+
+    def __init__(self):
+        super().__init__(queue.SimpleQueue())
+        self._pid = None
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def prepare(self, record):
+        # Formatage des arguments et de la trace d'exception ici, tant que les objets sont encore valides.
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    output = logging.StreamHandler(sys.stdout)
+                    output.setFormatter(_JsonFormatter() if LOG_FORMAT == "json" else _TextFormatter())
+                    self._listener = QueueListener(self.queue, output)
+                    self._listener.start()
+                    self._pid = os.getpid()
+        super().enqueue(record)
+
+
+_root = logging.getLogger("autolofi")
+_root.setLevel(LOG_LEVEL)
+_root.propagate = False
+if not _root.handlers:
+    _handler = _AsyncHandler()
+    _handler.addFilter(_ContextFilter())
+    _root.addHandler(_handler)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return _root.getChild(name)
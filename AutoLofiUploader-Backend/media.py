@@ -1,24 +1,46 @@
 # media.py (version finale épurée)
 
 import os
-import uuid
+import zlib
+import contextvars
 import requests
+from concurrent.futures import ThreadPoolExecutor
 
-# --- Constantes pour les API ---
-SUNO_API_URL = "https://apibox.erweima.ai/api/v1/generate"
-HUGGING_FACE_API_URL = "https://api-inference.huggingface.co/models/black-forest-labs/FLUX.1-dev"
+import http_client
+import image_cache
+import imaging
+import logs
+import metrics
+from scheduler import SCHEDULER
+from workers import StageTimer
+from zipstream import file_crc32
+from spool import spool_path, remove_files
+
+log = logs.get_logger("media")
+
+# --- Constantes pour les API (surchargeables, ex. vers les faux services de bench/fake_services.py) ---
+SUNO_API_URL = os.environ.get("SUNO_API_URL", "https://apibox.erweima.ai/api/v1/generate")
+HUGGING_FACE_API_URL = os.environ.get("HUGGING_FACE_API_URL",
+                                      "https://api-inference.huggingface.co/models/black-forest-labs/FLUX.1-dev")
+
+# --- Téléchargement de l'audio Suno ---
+AUDIO_CHUNK_SIZE = int(os.environ.get("AUDIO_CHUNK_SIZE", str(64 * 1024)))       # Taille du tampon de lecture
+AUDIO_MAX_BYTES = int(os.environ.get("AUDIO_MAX_BYTES", str(50 * 1024 * 1024)))  # Taille maximale acceptée
 
 def _call_suno_api(api_key: str, payload: dict) -> str:
     """Fonction interne pour appeler l'API Suno et gérer la réponse."""
-    print(f"🎵 Envoi de la requête à Suno avec le payload : {payload}")
+    log.debug("🎵 Envoi de la requête à Suno.", extra={"payload": payload})
     headers = {"Authorization": f"Bearer {api_key}"}
     try:
-        response = requests.post(SUNO_API_URL, headers=headers, json=payload, timeout=30)
-        print(f"   - Réponse BRUTE de Suno reçue (Statut {response.status_code}): {response.text}")
+        # Non idempotent : on ne retente que si Suno n'a pas pu traiter la demande (429/503, connexion impossible).
+        with metrics.timed("suno_request"):
+            response = http_client.request("POST", SUNO_API_URL, idempotent=False, headers=headers, json=payload, timeout=30)
         if response.status_code != 200:
+            log.warning("Réponse d'erreur de Suno.", extra={"http_status": response.status_code, "body": response.text[:500]})
             raise ValueError(f"Suno a répondu avec un code d'erreur HTTP {response.status_code}.")
         data = response.json()
         if data.get("code") != 200:
+             log.warning("Réponse d'erreur de Suno.", extra={"http_status": response.status_code, "body": response.text[:500]})
              raise ValueError(f"Suno a renvoyé une erreur : {data.get('msg')}")
         task_data = data.get("data")
         if not isinstance(task_data, dict):
@@ -26,7 +48,7 @@ def _call_suno_api(api_key: str, payload: dict) -> str:
         task_id = task_data.get("taskId")
         if not task_id:
             raise ValueError("Le dictionnaire 'data' ne contient pas de clé 'taskId'.")
-        print(f"✅ Tâche Suno démarrée avec succès ! ID : {task_id}")
+        log.info(f"✅ Tâche Suno démarrée avec succès ! ID : {task_id}", extra={"suno_task_id": task_id})
         return task_id
     except requests.exceptions.RequestException as e:
         raise IOError(f"Erreur réseau lors de l'appel à Suno : {e}") from e
@@ -37,7 +59,7 @@ def start_suno_generation(api_key: str, description: str, callback_url: str) ->
     """
     Génère une chanson complète (musique + voix) à partir d'une description.
     """
-    print("   - Lancement de la génération de musique automatique.")
+    log.debug("Lancement de la génération de musique automatique.")
     payload = {
         "prompt": description,
         "instrumental": False,
@@ -47,21 +69,113 @@ def start_suno_generation(api_key: str, description: str, callback_url: str) ->
     }
     return _call_suno_api(api_key, payload)
 
-def download_image_from_ia(api_key: str, prompt_text: str) -> str:
-    """
-    Appelle l'API d'image et sauvegarde le résultat directement sur disque.
-    """
-    print(f"🎨 Lancement de la génération d'image pour le prompt : '{prompt_text[:70]}...'")
-    headers = {"Authorization": f"Bearer {api_key}"}
+def _generate_image(api_key: str, prompt_text: str, dest_path: str):
+    """Appelle l'API d'image et sauvegarde le résultat directement sur disque."""
+    log.info(f"🎨 Lancement de la génération d'image pour le prompt : '{prompt_text[:70]}...'")
+    # x-wait-for-model : pendant le chargement du modèle (souvent 20 s ou plus), HuggingFace garde
+    # la requête ouverte au lieu de répondre 503 avec un simple `estimated_time` (sans Retry-After),
+    # que les quelques secondes de backoff de http_client ne suffiraient pas à couvrir.
+    headers = {"Authorization": f"Bearer {api_key}", "x-wait-for-model": "true"}
     payload = {"inputs": prompt_text}
-    temp_image_path = f"/tmp/{uuid.uuid4()}.jpg"
     try:
-        with requests.post(HUGGING_FACE_API_URL, headers=headers, json=payload, timeout=120, stream=True) as response:
+        with http_client.request("POST", HUGGING_FACE_API_URL, headers=headers, json=payload, timeout=120, stream=True) as response:
             response.raise_for_status()
-            with open(temp_image_path, 'wb') as f:
+            with open(dest_path, 'wb') as f:
                 for chunk in response.iter_content(chunk_size=8192):
                     f.write(chunk)
-        print(f"🖼️ Image téléchargée avec succès à : {temp_image_path}")
-        return temp_image_path
+        log.info(f"🖼️ Image téléchargée avec succès à : {dest_path}")
     except requests.exceptions.RequestException as e:
         raise IOError(f"Le téléchargement de l'image a échoué. Détails: {e}") from e
+
+def download_image_from_ia(api_key: str, prompt_text: str) -> str:
+    """
+    Renvoie le chemin (dans le spool) d'une image générée pour `prompt_text`. Les images
+    déjà générées pour le même modèle et le même prompt sont servies depuis image_cache.
+    Seules les générations réelles passent par la limite de débit de la clé (voir scheduler.py).
+    """
+    return image_cache.fetch(HUGGING_FACE_API_URL, prompt_text, lambda dest_path: SCHEDULER.call(
+        "huggingface", api_key, _generate_image, api_key, prompt_text, dest_path))
+
+def download_audio(audio_url: str, dest_path: str, chunk_size: int = AUDIO_CHUNK_SIZE, max_bytes: int = AUDIO_MAX_BYTES) -> int:
+    """
+    Télécharge le MP3 généré par Suno vers `dest_path` par blocs, sans le garder en mémoire.
+    Renvoie le CRC-32 du fichier, calculé au fil de l'eau.
+    """
+    part_path = dest_path + ".part"
+    crc, received = 0, 0
+    try:
+        with http_client.request("GET", audio_url, timeout=180, stream=True) as response:
+            response.raise_for_status()
+            announced = int(response.headers.get("Content-Length") or 0)
+            if announced > max_bytes:
+                raise IOError(f"Fichier audio trop volumineux ({announced} octets, maximum {max_bytes}).")
+            with open(part_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise IOError(f"Fichier audio trop volumineux (plus de {max_bytes} octets).")
+                    crc = zlib.crc32(chunk, crc)
+                    f.write(chunk)
+        os.replace(part_path, dest_path)
+        return crc
+    except requests.exceptions.RequestException as e:
+        raise IOError(f"Le téléchargement de l'audio a échoué. Détails: {e}") from e
+    finally:
+        remove_files(part_path)
+
+# --- Travaux exécutés dans le pool de fond (voir workers.py) ---
+
+def prefetch_image(api_key: str, prompt_text: str):
+    """
+    Génère l'image d'une tâche V1 avant la fin de la génération Suno, pour la seule
+    mise en cache : `prepare_v1_media` la trouvera dans image_cache (ou attendra la
+    génération en cours, via le verrou par clé du cache) au lieu de la relancer.
+    """
+    if image_cache.IMAGE_CACHE_MAX_BYTES <= 0:
+        return
+    remove_files(download_image_from_ia(api_key, prompt_text))
+
+def prepare_v1_media(task_id: str, audio_url: str, image_key: str, image_prompt: str) -> dict:
+    """
+    Travail V1 : télécharge l'audio et génère l'image de couverture en parallèle,
+    la durée totale est donc celle de la plus longue des deux étapes. L'image est
+    ensuite mise au cadre de la vidéo (voir imaging.py).
+    Les CRC sont calculés ici, hors requête, pour que /status puisse streamer le ZIP.
+    """
+    timer = StageTimer()
+    audio_path = spool_path(f"{task_id}_audio.mp3")
+
+    def fetch_audio():
+        with timer.stage("audio_download"):
+            return download_audio(audio_url, audio_path)
+
+    def fetch_image():
+        with timer.stage("image_generation"):
+            raw_path = download_image_from_ia(image_key, image_prompt)
+        with timer.stage("image_processing"):
+            images = imaging.prepare_cover(raw_path, task_id)
+        return images, {name: file_crc32(path) for name, path in images.items()}
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix=f"v1-{task_id[:8]}") as executor:
+        # copy_context : les deux threads gardent le trace_id de la tâche.
+        audio_future = executor.submit(contextvars.copy_context().run, fetch_audio)
+        image_future = executor.submit(contextvars.copy_context().run, fetch_image)
+    # La sortie du bloc attend la fin des deux étapes. Si l'une échoue, on ne laisse pas traîner le fichier de l'autre.
+    error = audio_future.exception() or image_future.exception()
+    if error:
+        remove_files(audio_path)
+        if not image_future.exception():
+            remove_files(*image_future.result()[0].values())
+        raise error
+    audio_crc = audio_future.result()
+    images, image_crcs = image_future.result()
+    return {"files": {"audio": audio_path, **images},
+            "crc32": {"audio": audio_crc, **image_crcs}, "timings": timer.timings}
+
+def prepare_v2_audio(task_id: str, audio_url: str) -> dict:
+    """Travail V2 : télécharge uniquement l'audio."""
+    timer = StageTimer()
+    with timer.stage("audio_download"):
+        audio_path = spool_path(f"{task_id}_audio.mp3")
+        download_audio(audio_url, audio_path)
+    return {"audio_path": audio_path, "timings": timer.timings}
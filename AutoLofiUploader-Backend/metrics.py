@@ -0,0 +1,127 @@
+# metrics.py (métriques exposées au format texte Prometheus, sans dépendance)
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# Les étapes vont de quelques millisecondes (lecture du Sheet) à plusieurs minutes (génération Suno, upload YouTube).
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+_metrics = []
+_collectors = []
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._values = {} if self.labelnames else {(): 0}  # Sans label : exposé à 0 dès le départ
+        with _lock:
+            _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with _lock:
+            return self._values.get(key, 0)
+
+    def values(self) -> dict:
+        """Valeur par combinaison de labels (tuple dans l'ordre de `labelnames`)."""
+        with _lock:
+            return dict(self._values)
+
+    def _render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}  # labels -> [compte par intervalle, somme, total]
+        with _lock:
+            _metrics.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with _lock:
+            counts, _, _ = state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {count}"
+
+
+def register_gauges(name: str, help_text: str, labelnames, collect):
+    """Jauge évaluée à chaque lecture de /metrics : `collect()` renvoie [(valeurs des labels, valeur)]."""
+    _collectors.append((name, help_text, tuple(labelnames), collect))
+
+
+def render() -> str:
+    """Toutes les métriques de ce worker au format d'exposition texte Prometheus 0.0.4."""
+    lines = []
+    with _lock:
+        for metric in _metrics:
+            lines.extend(metric._render())
+    for name, help_text, labelnames, collect in _collectors:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for values, value in collect():
+            lines.append(f"{name}{_labels(labelnames, values)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram("autolofi_stage_duration_seconds",
+                          "Durée de chaque étape du traitement, en secondes.", ("stage",))
+CALLBACKS = Counter("autolofi_suno_callbacks_total",
+                    "Callbacks Suno reçus, par architecture, type et issue.", ("version", "type", "outcome"))
+
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def observe_timings(timings: dict, prefix: str = ""):
+    """Enregistre les durées d'un StageTimer (ou de workers.WorkerPool) : {"audio_download": 1.2, ...}."""
+    for stage, seconds in (timings or {}).items():
+        observe_stage(prefix + stage, seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
@@ -0,0 +1,168 @@
+# notifier.py (attente d'un changement de statut : long-poll et Server-Sent Events)
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# --- Configuration ---
+LONG_POLL_MAX_WAIT = float(os.environ.get("LONG_POLL_MAX_WAIT", "60"))      # Plafond de ?wait=<secondes>
+NOTIFY_POLL_INTERVAL = float(os.environ.get("NOTIFY_POLL_INTERVAL", "0.5"))  # Relecture du store (autres workers)
+SSE_MAX_DURATION = float(os.environ.get("SSE_MAX_DURATION", "300"))        # Le client se reconnecte au-delà
+SSE_KEEPALIVE = float(os.environ.get("SSE_KEEPALIVE", "15"))               # Commentaire ": keepalive" pour les proxys
+# Chaque requête en attente occupe un thread gunicorn : garder ce plafond sous --threads, sinon les
+# callbacks Suno qui feraient avancer les tâches attendues ne trouvent plus de thread libre.
+NOTIFY_MAX_WAITERS = int(os.environ.get("NOTIFY_MAX_WAITERS", "16"))       # Long-polls et flux SSE simultanés, par worker
+NOTIFY_RETRY_AFTER = int(os.environ.get("NOTIFY_RETRY_AFTER", "5"))        # Secondes conseillées au client au-delà
+
+# Statuts pendant lesquels un client n'a rien d'autre à faire qu'attendre.
+WAITING_STATUSES = ("queued", "pending", "downloading")
+
+_waiters = {}  # (namespace, task_id) -> ensemble des threading.Event des requêtes en attente
+_reserved = 0  # Requêtes long-poll et SSE en cours (places prises sur NOTIFY_MAX_WAITERS)
+_lock = threading.Lock()
+
+
+def notify(namespace: str, task_id: str):
+    """
+    Réveille immédiatement les requêtes de ce worker qui attendent `task_id`.
+    À appeler après chaque changement de statut (callbacks, fin des téléchargements).
+    Les requêtes en attente dans un autre worker gunicorn le voient à leur prochaine
+    relecture du store, au plus NOTIFY_POLL_INTERVAL secondes plus tard.
+    """
+    with _lock:
+        events = list(_waiters.get((namespace, task_id), ()))
+    for event in events:
+        event.set()
+
+
+def waiting() -> int:
+    """Nombre de requêtes (long-poll ou SSE) de ce worker actuellement en attente d'un changement de statut."""
+    with _lock:
+        return _reserved
+
+
+def try_reserve() -> bool:
+    """Prend une place d'attente pour toute la durée d'une requête ; False si les NOTIFY_MAX_WAITERS sont prises."""
+    global _reserved
+    with _lock:
+        if _reserved >= NOTIFY_MAX_WAITERS:
+            return False
+        _reserved += 1
+        return True
+
+
+def release():
+    global _reserved
+    with _lock:
+        _reserved -= 1
+
+
+@contextmanager
+def _subscription(keys):
+    """Un threading.Event réveillé par `notify` sur n'importe laquelle des clés (namespace, task_id)."""
+    event = threading.Event()
+    with _lock:
+        for key in keys:
+            _waiters.setdefault(key, set()).add(event)
+    try:
+        yield event
+    finally:
+        with _lock:
+            for key in keys:
+                _waiters[key].discard(event)
+                if not _waiters[key]:
+                    del _waiters[key]
+
+
+def _status(task):
+    return task.get("status", "unknown") if task else None
+
+
+def wait_for_change(store, namespace: str, task_id: str, status, timeout: float):
+    """
+    Bloque jusqu'à ce que le statut de la tâche ne soit plus `status` (ou qu'elle
+    disparaisse), au plus `timeout` secondes. Renvoie l'enregistrement courant (ou None).
+    """
+    deadline = time.monotonic() + max(0.0, min(timeout, LONG_POLL_MAX_WAIT))
+    with _subscription([(namespace, task_id)]) as event:
+        while True:
+            task = store.get(task_id)
+            remaining = deadline - time.monotonic()
+            if _status(task) != status or remaining <= 0:
+                return task
+            event.wait(min(remaining, NOTIFY_POLL_INTERVAL))
+            event.clear()
+
+
+def wait_until_settled(store, namespace: str, task_id: str, timeout: float):
+    """Comme `wait_for_change`, mais traverse les statuts d'attente successifs (pending -> downloading -> ...)."""
+    deadline = time.monotonic() + max(0.0, min(timeout, LONG_POLL_MAX_WAIT))
+    task = store.get(task_id)
+    while _status(task) in WAITING_STATUSES and time.monotonic() < deadline:
+        task = wait_for_change(store, namespace, task_id, _status(task), deadline - time.monotonic())
+    return task
+
+
+def wait_param(args) -> float:
+    """Lit `?wait=<secondes>` (0 si absent ou invalide)."""
+    try:
+        return max(0.0, float(args.get("wait", 0)))
+    except ValueError:
+        return 0.0
+
+
+def sse_stream(store, namespace: str, task_id: str, describe):
+    """
+    Générateur Server-Sent Events : un évènement `status` à chaque changement de statut
+    (`describe(task)` fournit le corps JSON), jusqu'à un statut final ou SSE_MAX_DURATION.
+    """
+    deadline = time.monotonic() + SSE_MAX_DURATION
+    task = store.get(task_id)
+    while True:
+        status = _status(task)
+        payload = describe(task) if task else {"status": "not_found"}
+        yield f"event: status\ndata: {json.dumps(payload)}\n\n"
+        if status not in WAITING_STATUSES:
+            return
+        while _status(task) == status:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            task = wait_for_change(store, namespace, task_id, status, min(remaining, SSE_KEEPALIVE))
+            if _status(task) == status:
+                yield ": keepalive\n\n"
+
+
+def sse_snapshots(namespace: str, task_ids, snapshot, settled):
+    """
+    Flux Server-Sent Events d'un ensemble de tâches (un lot) : un évènement `status` chaque fois
+    que `snapshot()` change, jusqu'à ce que `settled(snapshot)` soit vrai ou SSE_MAX_DURATION.
+    Un seul flux suit tout le lot, au lieu d'un flux (et d'un thread) par tâche.
+    """
+    deadline = time.monotonic() + SSE_MAX_DURATION
+    last, last_sent = None, time.monotonic()
+    with _subscription([(namespace, task_id) for task_id in task_ids]) as event:
+        while True:
+            current = snapshot()
+            if current != last:
+                yield f"event: status\ndata: {json.dumps(current)}\n\n"
+                last, last_sent = current, time.monotonic()
+                if current is None or settled(current):
+                    return
+            elif time.monotonic() - last_sent >= SSE_KEEPALIVE:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield "event: timeout\ndata: {}\n\n"
+                return
+            event.wait(min(remaining, NOTIFY_POLL_INTERVAL))
+            event.clear()
+
+
+def sse_busy(payload: dict):
+    """Flux SSE réduit quand les places d'attente sont prises : l'état actuel, puis reconnexion après NOTIFY_RETRY_AFTER."""
+    yield f"retry: {NOTIFY_RETRY_AFTER * 1000}\nevent: status\ndata: {json.dumps(payload)}\n\n"
@@ -0,0 +1,196 @@
+# publisher.py (publication YouTube asynchrone et reprenable)
+
+import os
+import ssl
+import time
+import socket
+import uuid
+import random
+
+import gspread
+import httplib2
+import requests
+from googleapiclient.errors import HttpError
+
+import logs
+import metrics
+import services
+import task_store
+import workers
+from spool import remove_files
+
+log = logs.get_logger("publisher")
+
+# --- Configuration ---
+PUBLISH_POOL_SIZE = int(os.environ.get("PUBLISH_POOL_SIZE", "2"))          # Uploads YouTube simultanés par worker
+PUBLISH_QUEUE_MAX = int(os.environ.get("PUBLISH_QUEUE_MAX", "8"))
+PUBLISH_MAX_ATTEMPTS = int(os.environ.get("PUBLISH_MAX_ATTEMPTS", "5"))    # Reprises de la session d'upload
+PUBLISH_LEASE_SECONDS = int(os.environ.get("PUBLISH_LEASE_SECONDS", "300"))  # Sans progrès au-delà, un job est repris
+
+# Un pool séparé de celui des callbacks : un long upload ne doit pas bloquer les téléchargements Suno.
+PUBLISH_POOL = workers.WorkerPool(kind="thread", size=PUBLISH_POOL_SIZE, queue_max=PUBLISH_QUEUE_MAX)
+PUBLISH_STORE = task_store.open_task_store("publish")
+
+ACTIVE_STATUSES = ("queued", "uploading")
+
+
+def _owner() -> str:
+    """Processus qui exécute un job : machine et pid du worker gunicorn."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_is_dead(owner) -> bool:
+    """Vrai si le worker propriétaire a disparu (tué par l'OOM, timeout gunicorn...). Vérifiable sur cette machine seulement."""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # Le pid existe (autre utilisateur)
+    return False
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    if isinstance(error, gspread.exceptions.APIError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, (ConnectionError, TimeoutError, ssl.SSLError, httplib2.HttpLib2Error,
+                              requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def _update_sheet(job_id: str, metadata: dict, video_url: str):
+    """Écrit l'URL dans le Google Sheet ; un 429/5xx passager est retenté (la vidéo, elle, est déjà en ligne)."""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            sheets_client = services.get_sheets_client(metadata['access_token'])
+            with metrics.timed("sheets_update"):
+                services.update_video_url_in_sheet(sheets_client, metadata['sheet_id'], metadata['prompt_id'], video_url)
+            return
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= PUBLISH_MAX_ATTEMPTS:
+                raise
+            delay = random.uniform(0, min(60, 2 ** attempt))
+            log.warning(f"[Publish] Job {job_id} : Google Sheet indisponible ({e}), nouvelle tentative dans {delay:.1f}s.")
+            time.sleep(delay)
+
+
+def enqueue(video_path: str, metadata: dict) -> str:
+    """Enregistre un job de publication et le confie au pool. Lève workers.QueueFullError si le pool est saturé."""
+    job_id = str(uuid.uuid4())
+    PUBLISH_STORE[job_id] = {
+        "status": "queued", "video_path": video_path, "metadata": metadata,
+        "resumable_uri": None, "bytes_sent": 0, "total_bytes": os.path.getsize(video_path), "attempts": 0,
+        "trace_id": logs.current_trace_id(), "owner": _owner(),
+    }
+    try:
+        _submit(job_id)
+    except workers.QueueFullError:
+        PUBLISH_STORE.pop(job_id)
+        raise
+    return job_id
+
+
+def _submit(job_id: str):
+    def on_error(error):
+        log.error(f"❌ [Publish] Échec inattendu du job {job_id}.", exc_info=error)
+    PUBLISH_POOL.submit(run_job, job_id, on_error=on_error)
+
+
+def run_job(job_id: str):
+    """Uploade la vidéo par morceaux (reprise possible), puis met à jour le Google Sheet."""
+    job = PUBLISH_STORE.get(job_id)
+    if not job:
+        return
+    job.update(status="uploading", owner=_owner())
+    if not PUBLISH_STORE.transition(job_id, ("queued",), job):
+        return  # Déjà pris en charge par un autre worker
+    with logs.trace(job.get("trace_id")):  # Aussi pour les jobs repris au démarrage
+        _upload_and_update_sheet(job_id, job)
+
+
+def _upload_and_update_sheet(job_id: str, job: dict):
+    metadata = job["metadata"]
+
+    def on_progress(resumable_uri, bytes_sent, total_bytes):
+        job.update(resumable_uri=resumable_uri, bytes_sent=bytes_sent, total_bytes=total_bytes)
+        PUBLISH_STORE[job_id] = job
+
+    upload_started = time.perf_counter()
+    while True:
+        job["attempts"] += 1
+        PUBLISH_STORE[job_id] = job
+        try:
+            video_url = services.upload_to_youtube(
+                metadata['access_token'], job["video_path"],
+                metadata['video_title'], metadata['video_description'], metadata['video_tags'],
+                metadata.get('visibility', 'private'),
+                resumable_uri=job.get("resumable_uri"), on_progress=on_progress
+            )
+            break
+        except Exception as e:
+            if not _is_retryable(e) or job["attempts"] >= PUBLISH_MAX_ATTEMPTS:
+                log.exception(f"❌ [Publish] Échec de l'upload du job {job_id}.")
+                remove_files(job["video_path"])
+                PUBLISH_STORE[job_id] = {"status": "error", "message": f"Échec de l'upload YouTube : {e}",
+                                         "bytes_sent": job["bytes_sent"], "total_bytes": job["total_bytes"],
+                                         "trace_id": job.get("trace_id")}
+                return
+            delay = random.uniform(0, min(60, 2 ** job["attempts"]))
+            log.warning(f"[Publish] Job {job_id} interrompu ({e}), reprise à l'octet {job['bytes_sent']} dans {delay:.1f}s.")
+            time.sleep(delay)
+
+    metrics.observe_stage("youtube_upload", time.perf_counter() - upload_started)
+    remove_files(job["video_path"])
+    result = {"status": "published", "video_url": video_url,
+              "bytes_sent": job["total_bytes"], "total_bytes": job["total_bytes"]}
+    try:
+        _update_sheet(job_id, metadata, video_url)
+    except Exception as e:
+        # La vidéo est en ligne : on ne relance surtout pas l'upload, on signale seulement le Sheet.
+        log.exception(f"[Publish] Job {job_id} : Google Sheet non mis à jour.")
+        result.update(status="error", message=f"Vidéo publiée mais Google Sheet non mis à jour : {e}")
+    PUBLISH_STORE[job_id] = {**result, "trace_id": job.get("trace_id")}
+    log.info(f"✅ [Publish] Job {job_id} terminé : {result['status']} ({video_url}).")
+
+
+def resume_stalled_jobs():
+    """
+    Relance les jobs dont l'upload s'est arrêté : tout de suite si leur worker est mort
+    (redémarrage, OOM, timeout gunicorn...), sinon après PUBLISH_LEASE_SECONDS sans progrès.
+    Appelée au démarrage puis à chaque passage du reaper.
+    """
+    now = time.time()
+    for job_id, job, updated_at in PUBLISH_STORE.items():
+        if job.get("status") not in ACTIVE_STATUSES:
+            continue
+        if now - updated_at < PUBLISH_LEASE_SECONDS and not _owner_is_dead(job.get("owner")):
+            continue
+        if not os.path.exists(job.get("video_path") or ""):
+            PUBLISH_STORE[job_id] = {"status": "error", "message": "Vidéo introuvable, upload impossible à reprendre."}
+            continue
+        if PUBLISH_STORE.transition(job_id, (job["status"],), {**job, "status": "queued", "owner": _owner()}):
+            log.info(f"[Publish] Reprise du job {job_id} à l'octet {job.get('bytes_sent', 0)}.")
+            try:
+                _submit(job_id)
+            except workers.QueueFullError:
+                break
+
+
+def job_status(job_id: str):
+    """Statut public d'un job (sans le token ni les chemins internes), ou None s'il est inconnu."""
+    job = PUBLISH_STORE.get(job_id)
+    if not job:
+        return None
+    total = job.get("total_bytes") or 0
+    status = {"status": job["status"], "bytes_sent": job.get("bytes_sent", 0), "total_bytes": total,
+              "progress": round(100 * job.get("bytes_sent", 0) / total, 1) if total else 0.0}
+    for key in ("video_url", "message", "trace_id"):
+        if job.get(key):
+            status[key] = job[key]
+    return status
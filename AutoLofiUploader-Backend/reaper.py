@@ -0,0 +1,180 @@
+# reaper.py (nettoyage des tâches abandonnées et des fichiers orphelins du spool)
+
+import os
+import time
+import shutil
+import fcntl
+import threading
+
+import logs
+import metrics
+from spool import SPOOL_DIR, remove_files
+
+log = logs.get_logger("reaper")
+
+# --- Configuration ---
+REAPER_INTERVAL = int(os.environ.get("REAPER_INTERVAL", "60"))             # Secondes entre deux passages
+REAPER_ORPHAN_GRACE = int(os.environ.get("REAPER_ORPHAN_GRACE", "3600"))   # Âge minimal d'un fichier orphelin
+SPOOL_MAX_MB = int(os.environ.get("SPOOL_MAX_MB", "1024"))                 # Taille maximale du spool
+DISK_HIGH_WATER = float(os.environ.get("DISK_HIGH_WATER", "0.90"))         # Taux d'occupation du disque toléré
+
+# Durée de vie (secondes) d'une tâche sans mise à jour, par statut. Surchargeable
+# avec REAPER_TTL_<STATUT>, par exemple REAPER_TTL_PENDING=7200.
+DEFAULT_TTLS = {
+    "queued": 2 * 3600,
+    "pending": 2 * 3600,
+    "downloading": 3600,
+    "ready_for_download": 24 * 3600,
+    "ready": 24 * 3600,
+    "downloaded": 3600,  # ZIP (V1) ou audio (V2) envoyé en entier, réception non confirmée par le client
+    "error": 3600,
+    "published": 3600,
+    "received": 24 * 3600,  # Callbacks Suno déjà traités (dédoublonnage)
+}
+DEFAULT_TTL = 24 * 3600
+
+# Statuts dont les fichiers peuvent être évincés quand le disque est trop plein (les plus anciens d'abord).
+EVICTABLE_STATUSES = ("ready_for_download", "ready", "downloaded")
+
+# Compteurs de ce worker, exposés par /metrics et /reaper/stats.
+_COUNTERS = {
+    "runs": metrics.Counter("autolofi_reaper_runs_total", "Balayages complets du spool."),
+    "tasks_expired": metrics.Counter("autolofi_reaper_tasks_expired_total", "Tâches supprimées après leur TTL."),
+    "tasks_evicted": metrics.Counter("autolofi_reaper_tasks_evicted_total",
+                                     "Tâches prêtes dont les fichiers ont été évincés faute d'espace disque."),
+    "orphans_deleted": metrics.Counter("autolofi_reaper_orphans_deleted_total",
+                                       "Fichiers du spool supprimés faute de tâche qui les référence."),
+    "files_deleted": metrics.Counter("autolofi_reaper_files_deleted_total", "Fichiers supprimés par le reaper."),
+    "bytes_freed": metrics.Counter("autolofi_reaper_freed_bytes_total", "Octets libérés par le reaper."),
+}
+_started = False
+
+
+def ttl_for(status: str) -> int:
+    return int(os.environ.get(f"REAPER_TTL_{(status or 'unknown').upper()}", DEFAULT_TTLS.get(status, DEFAULT_TTL)))
+
+
+def task_files(task: dict) -> list:
+    """Liste les fichiers du spool référencés par un enregistrement de tâche."""
+    paths = list((task.get("files") or {}).values())
+    paths += [task.get(key) for key in ("audio_path", "video_path")]
+    return [path for path in paths if isinstance(path, str)]
+
+
+def stats() -> dict:
+    return {key: int(counter.value()) for key, counter in _COUNTERS.items()}
+
+
+def _count(**increments):
+    for key, value in increments.items():
+        _COUNTERS[key].inc(value)
+
+
+def _delete(paths):
+    existing = [path for path in paths if os.path.exists(path)]
+    freed = remove_files(*existing)
+    _count(files_deleted=len(existing), bytes_freed=freed)
+    return freed
+
+
+def _spool_entries():
+    """Parcourt le spool en un seul scandir : liste de (chemin, taille, mtime)."""
+    try:
+        with os.scandir(SPOOL_DIR) as it:
+            return [(entry.path, st.st_size, st.st_mtime)
+                    for entry in it if entry.is_file(follow_symlinks=False) and not entry.name.startswith(".")
+                    for st in (entry.stat(follow_symlinks=False),)]
+    except FileNotFoundError:
+        return []
+
+
+def _over_high_water(spool_bytes: int) -> bool:
+    if spool_bytes > SPOOL_MAX_MB * 1024 * 1024:
+        return True
+    usage = shutil.disk_usage(SPOOL_DIR)
+    return usage.used / usage.total > DISK_HIGH_WATER
+
+
+def sweep(stores: dict):
+    """
+    Un passage complet :
+      1. supprime les tâches dont le TTL (selon leur statut) est dépassé, avec leurs fichiers ;
+      2. supprime les fichiers du spool qui ne sont référencés par aucune tâche ;
+      3. au-dessus du seuil d'occupation, évince les fichiers des tâches prêtes les plus anciennes.
+    """
+    now = time.time()
+    live = []  # (updated_at, store, task_id, task) des tâches conservées
+    for store in stores.values():
+        for task_id, task, updated_at in store.items():
+            if now - updated_at > ttl_for(task.get("status")):
+                if store.pop(task_id) is not None:
+                    _delete(task_files(task))
+                    _count(tasks_expired=1)
+                    log.info(f"🧹 [Reaper] Tâche expirée supprimée : {task_id} ({task.get('status')}).")
+            else:
+                live.append((updated_at, store, task_id, task))
+
+    referenced = {path for _, _, _, task in live for path in task_files(task)}
+    entries = []
+    for path, size, mtime in _spool_entries():
+        if path not in referenced and now - mtime > REAPER_ORPHAN_GRACE:
+            _delete([path])
+            _count(orphans_deleted=1)
+        else:
+            entries.append((path, size))
+
+    spool_bytes = sum(size for _, size in entries)
+    if not _over_high_water(spool_bytes):
+        return
+    for updated_at, store, task_id, task in sorted(live, key=lambda item: item[0]):
+        if task.get("status") not in EVICTABLE_STATUSES:
+            continue
+        message = "Fichiers supprimés faute d'espace disque avant leur téléchargement. Relancez la génération."
+        if store.transition(task_id, EVICTABLE_STATUSES, {"status": "error", "message": message}):
+            spool_bytes -= _delete(task_files(task))
+            _count(tasks_evicted=1)
+            log.warning(f"🧹 [Reaper] Fichiers de la tâche {task_id} évincés (spool au-dessus du seuil).")
+        if not _over_high_water(spool_bytes):
+            break
+
+
+def _run_once(stores: dict):
+    # Un seul worker gunicorn balaie le spool à la fois ; les autres sautent leur tour.
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    with open(os.path.join(SPOOL_DIR, ".reaper.lock"), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        try:
+            sweep(stores)
+            _count(runs=1)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def start(stores: dict, hooks=()):
+    """
+    Balaie le spool immédiatement puis toutes les REAPER_INTERVAL secondes, dans un thread démon.
+    `hooks` : fonctions sans argument appelées à chaque passage, dans chaque worker (même
+    quand un autre tient le verrou du balayage).
+    """
+    global _started
+    if _started:
+        return
+    _started = True
+
+    def _loop():
+        while True:
+            try:
+                _run_once(stores)
+            except Exception:
+                log.exception("[Reaper] Échec du balayage du spool.")
+            for hook in hooks:
+                try:
+                    hook()
+                except Exception:
+                    log.exception(f"[Reaper] Échec de la tâche périodique {hook.__name__}.")
+            time.sleep(REAPER_INTERVAL)
+
+    threading.Thread(target=_loop, name="spool-reaper", daemon=True).start()
@@ -0,0 +1,175 @@
+# scheduler.py (limitation de débit par clé d'API pour Suno et HuggingFace)
+
+import os
+import time
+import heapq
+import hashlib
+import itertools
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# --- Configuration ---
+# Débit autorisé par clé d'API, en requêtes par seconde et taille de rafale : "fournisseur=débit/rafale,...".
+# Garder une marge sous la limite du fournisseur (gigue réseau). Les compteurs sont propres
+# à chaque worker gunicorn : avec N workers, diviser les débits par N.
+DEFAULT_LIMITS = {"suno": (0.5, 5), "huggingface": (0.2, 3)}
+
+
+def _parse_limits(spec: str) -> dict:
+    limits = {}
+    for item in spec.split(","):
+        provider, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        if provider.strip() and rate:
+            limits[provider.strip()] = (float(rate), float(burst or 1))
+    return limits
+
+
+SCHEDULER_LIMITS = _parse_limits(os.environ.get("SCHEDULER_LIMITS", ""))
+SCHEDULER_WORKERS = int(os.environ.get("SCHEDULER_WORKERS", "8"))  # Appels différés exécutés en parallèle
+
+# Dans la file d'une clé, les travaux de priorité plus haute passent devant (puis ordre d'arrivée).
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class TokenBucket:
+    """Seau à jetons : `rate` jetons par seconde, au plus `burst` d'avance."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self._updated:  # `now` peut précéder la création du seau
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def try_take(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self, now: float, position: int = 0) -> float:
+        """Secondes avant qu'un jeton soit disponible pour le travail en `position` dans la file."""
+        self._refill(now)
+        return max(0.0, (position + 1 - self.tokens) / self.rate)
+
+
+class _KeyQueue:
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.jobs = []  # tas de (priorité, n° d'arrivée, future, fn, args, contexte de l'appelant)
+
+
+class Scheduler:
+    """
+    File d'attente équitable par (fournisseur, clé d'API) : chaque clé a son propre
+    seau à jetons, et le répartiteur sert les clés à tour de rôle. Un appel qui
+    dépasse la limite n'échoue pas : il attend son tour et l'appelant connaît
+    l'heure estimée de son départ.
+    """
+
+    def __init__(self, limits: dict = None, workers: int = SCHEDULER_WORKERS):
+        self.limits = {**DEFAULT_LIMITS, **(limits if limits is not None else SCHEDULER_LIMITS)}
+        self.workers = workers
+        self._queues = {}
+        self._order = []  # Ordre de service des clés (tourniquet)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pid = None
+        self._executor = None
+
+    def _key_queue(self, provider: str, api_key: str) -> _KeyQueue:
+        key = (provider, api_key)
+        if key not in self._queues:
+            self._queues[key] = _KeyQueue(*self.limits[provider])
+            self._order.append(key)
+        return self._queues[key]
+
+    def _ensure_started(self):
+        # Démarrage paresseux : un répartiteur par processus (les threads ne survivent pas au fork de gunicorn).
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._queues, self._order = {}, []
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler")
+            threading.Thread(target=self._dispatch_loop, name="scheduler-dispatch", daemon=True).start()
+
+    def run_or_queue(self, provider: str, api_key: str, fn, *args, priority: str = "normal"):
+        """
+        Exécute `fn(*args)` tout de suite si la clé a un jeton et personne devant elle,
+        et renvoie (True, résultat). Sinon met l'appel en file et renvoie (False, future),
+        avec `future.estimated_start` (timestamp) ; `fn` sera exécutée par le répartiteur.
+        """
+        now = time.monotonic()
+        with self._cond:
+            self._ensure_started()
+            queue = self._key_queue(provider, api_key)
+            immediate = not queue.jobs and queue.bucket.try_take(now)
+            if not immediate:
+                position = sum(1 for job in queue.jobs if job[0] <= PRIORITIES[priority])
+                future = Future()
+                future.estimated_start = time.time() + queue.bucket.delay(now, position)
+                heapq.heappush(queue.jobs, (PRIORITIES[priority], next(self._seq), future, fn, args,
+                                            contextvars.copy_context()))
+                self._cond.notify()
+        if immediate:
+            return True, fn(*args)
+        return False, future
+
+    def call(self, provider: str, api_key: str, fn, *args, priority: str = "normal"):
+        """Comme `run_or_queue`, mais attend son tour et renvoie toujours le résultat de `fn`."""
+        immediate, value = self.run_or_queue(provider, api_key, fn, *args, priority=priority)
+        return value if immediate else value.result()
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                next_wake = None
+                ready = []
+                for key in list(self._order):
+                    queue = self._queues[key]
+                    if not queue.jobs:
+                        continue
+                    if queue.bucket.try_take(now):
+                        ready.append(heapq.heappop(queue.jobs))
+                        # Tourniquet : la clé servie passe en fin de tour.
+                        self._order.remove(key)
+                        self._order.append(key)
+                    if queue.jobs:
+                        wait = queue.bucket.delay(now)
+                        next_wake = wait if next_wake is None else min(next_wake, wait)
+                if not ready:
+                    self._cond.wait(next_wake)
+            for _, _, future, fn, args, context in ready:
+                self._executor.submit(context.run, self._run, future, fn, args)
+
+    @staticmethod
+    def _run(future, fn, args):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def stats(self) -> dict:
+        """Profondeur de file et jetons disponibles par fournisseur et clé (empreinte de la clé)."""
+        now = time.monotonic()
+        with self._cond:
+            result = {}
+            for (provider, api_key), queue in self._queues.items():
+                queue.bucket._refill(now)
+                fingerprint = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+                result.setdefault(provider, {})[fingerprint] = {
+                    "queued": len(queue.jobs), "tokens": round(queue.bucket.tokens, 2),
+                    "next_start_in": round(queue.bucket.delay(now, len(queue.jobs) - 1), 2) if queue.jobs else 0.0}
+            return result
+
+
+SCHEDULER = Scheduler()
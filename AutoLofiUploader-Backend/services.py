@@ -1,51 +1,263 @@
 # services.py (version finale épurée)
 
 import gspread
+import requests
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 import os
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import logs
+
+log = logs.get_logger("services")
 
 SCOPES_YOUTUBE = ['https://www.googleapis.com/auth/youtube.upload']
 
+# Racines des API Google, surchargeables (ex. vers les faux services de bench/fake_services.py).
+SHEETS_API_ROOT = "https://sheets.googleapis.com/"
+GOOGLE_SHEETS_API_URL = os.environ.get("GOOGLE_SHEETS_API_URL", SHEETS_API_ROOT)
+YOUTUBE_API_ROOT_URL = os.environ.get("YOUTUBE_API_ROOT_URL", "")  # Vide : celle du document de découverte
+
+# Durée de vie des clients mis en cache : un access token Google expire au bout d'une heure.
+GOOGLE_TOKEN_TTL = int(os.environ.get("GOOGLE_TOKEN_TTL", "3300"))
+GOOGLE_CLIENT_CACHE_SIZE = int(os.environ.get("GOOGLE_CLIENT_CACHE_SIZE", "64"))
+# Durée pendant laquelle le bloc A:K d'une feuille (et l'index prompt_id -> ligne) est réutilisé sans relecture.
+SHEETS_INDEX_TTL = int(os.environ.get("SHEETS_INDEX_TTL", "300"))
+
+SHEET_COLUMNS = 11  # Colonnes A à K
+COL_VIDEO_URL = 7  # Colonne G (URL), suivie de H (statut)
+
+# Taille des morceaux envoyés à YouTube (multiple de 256 Ko exigé par l'API).
+YOUTUBE_UPLOAD_CHUNK_SIZE = int(os.environ.get("YOUTUBE_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+YOUTUBE_CHUNK_RETRIES = int(os.environ.get("YOUTUBE_CHUNK_RETRIES", "3"))
+
+class _TTLCache:
+    """Cache LRU borné dont chaque entrée expire après un TTL."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # clé -> (expire_à, valeur)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate):
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]
+
+
+_SHEETS_CLIENTS = _TTLCache(GOOGLE_CLIENT_CACHE_SIZE)    # hash du token -> gspread.Client
+_WORKSHEETS = _TTLCache(GOOGLE_CLIENT_CACHE_SIZE * 4)    # (id du client, sheet_id) -> (client, _SheetRows)
+
+def _token_key(access_token: str) -> str:
+    return hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+
+def invalidate_token(access_token: str):
+    """Oublie les clients et feuilles en cache pour ce token (à appeler sur une erreur d'authentification)."""
+    key = _token_key(access_token)
+    client = _SHEETS_CLIENTS.get(key)
+    _SHEETS_CLIENTS.invalidate(lambda k: k == key)
+    if client is not None:
+        _WORKSHEETS.invalidate(lambda k: k[0] == id(client))
+
+def is_auth_error(error: Exception) -> bool:
+    """Vrai si Google refuse le token (expiré, révoqué, sans accès au classeur), pas pour un 429 ou un 5xx passager."""
+    if isinstance(error, RefreshError):
+        return True
+    return getattr(getattr(error, "response", None), "status_code", None) in (401, 403)
+
+class _RebasedAdapter(requests.adapters.HTTPAdapter):
+    """Envoie vers `base_url` les requêtes adressées à `root` (les URL de gspread sont fixes)."""
+
+    def __init__(self, root: str, base_url: str):
+        super().__init__()
+        self.root, self.base_url = root, base_url.rstrip("/") + "/"
+
+    def send(self, request, **kwargs):
+        request.url = self.base_url + request.url[len(self.root):]
+        return super().send(request, **kwargs)
+
 def get_sheets_client(access_token: str):
-    creds = Credentials(token=access_token)
-    return gspread.Client(auth=creds)
+    """Client gspread autorisé, réutilisé tant que le token est valide."""
+    key = _token_key(access_token)
+    client = _SHEETS_CLIENTS.get(key)
+    if client is None:
+        creds = Credentials(token=access_token)
+        session = None
+        if GOOGLE_SHEETS_API_URL.rstrip("/") != SHEETS_API_ROOT.rstrip("/"):
+            session = AuthorizedSession(creds)
+            session.mount(SHEETS_API_ROOT, _RebasedAdapter(SHEETS_API_ROOT, GOOGLE_SHEETS_API_URL))
+        client = gspread.Client(auth=creds, session=session)
+        _SHEETS_CLIENTS.put(key, client, GOOGLE_TOKEN_TTL)
+    return client
+
+class _SheetRows:
+    """
+    Bloc A:K de la première feuille d'un classeur, lu en un seul `values_get`,
+    avec un index prompt_id -> numéro de ligne. Relu quand il a plus de
+    SHEETS_INDEX_TTL secondes ou quand un prompt_id est introuvable.
+    """
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.rows = []
+        self.row_of = {}
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def _is_fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < SHEETS_INDEX_TTL
+
+    def reload(self):
+        values = self.worksheet.get_values("A:K")
+        rows = [row + [''] * (SHEET_COLUMNS - len(row)) for row in values]
+        with self._lock:
+            self.rows = rows
+            self.row_of = {row[0]: number for number, row in enumerate(rows, start=1) if row[0]}
+            self.loaded_at = time.monotonic()
+
+    def row_number(self, prompt_id: str) -> int:
+        if not self._is_fresh() or prompt_id not in self.row_of:
+            self.reload()
+        number = self.row_of.get(prompt_id)
+        if not number:
+            raise ValueError(f"Prompt avec l'ID '{prompt_id}' non trouvé.")
+        return number
+
+    def current_row_number(self, prompt_id: str) -> int:
+        """
+        Numéro de ligne vérifié juste avant une écriture, en relisant la colonne A : des lignes
+        ont pu être insérées, supprimées ou triées depuis la lecture de l'index. Si le prompt
+        a bougé, l'index est marqué périmé et sera relu à la prochaine lecture.
+        """
+        ids = [row[0] if row else '' for row in self.worksheet.get_values("A:A")]
+        with self._lock:
+            number = self.row_of.get(prompt_id)
+            if number and number <= len(ids) and ids[number - 1] == prompt_id:
+                return number
+            self.loaded_at = None
+        if prompt_id not in ids:
+            raise ValueError(f"Prompt avec l'ID '{prompt_id}' non trouvé.")
+        return ids.index(prompt_id) + 1
+
+    def row(self, number: int) -> list:
+        return list(self.rows[number - 1])
+
+    def set_cells(self, number: int, first_column: int, values: list):
+        with self._lock:
+            if self.loaded_at is not None and number <= len(self.rows):
+                self.rows[number - 1][first_column - 1:first_column - 1 + len(values)] = values
+
+def _get_sheet(client: gspread.Client, sheet_id: str) -> _SheetRows:
+    """Première feuille du classeur, sans refaire `open_by_key` (et son appel de métadonnées) à chaque requête."""
+    key = (id(client), sheet_id)
+    cached = _WORKSHEETS.get(key)
+    if cached is not None and cached[0] is client:  # `is` : protège contre la réutilisation d'un id()
+        return cached[1]
+    sheet = _SheetRows(client.open_by_key(sheet_id).sheet1)
+    _WORKSHEETS.put(key, (client, sheet), GOOGLE_TOKEN_TTL)
+    return sheet
 
 def get_prompt_from_sheet(client: gspread.Client, sheet_id: str, prompt_id: str):
     """
     Récupère une ligne de prompt, garantissant que 11 colonnes (A à K) sont retournées.
+    Un seul appel à l'API (aucun si l'index de la feuille est encore frais).
     """
-    sheet = client.open_by_key(sheet_id).sheet1
-    cell = sheet.find(prompt_id, in_column=1)
-    if not cell:
-        raise ValueError(f"Prompt avec l'ID '{prompt_id}' non trouvé.")
-    
-    row_number = cell.row
-    range_to_get = f'A{row_number}:K{row_number}' # Lire jusqu'à la colonne K
-    values = sheet.get(range_to_get)
-    
-    prompt_data = values[0] if values else []
-    
-    while len(prompt_data) < 11: # S'assurer d'avoir 11 éléments
-        prompt_data.append('')
-    return prompt_data
+    sheet = _get_sheet(client, sheet_id)
+    return sheet.row(sheet.row_number(prompt_id))
+
+def get_prompt_rows(client: gspread.Client, sheet_id: str, prompt_ids: list = None, pending: bool = False):
+    """
+    Lit en une seule requête les lignes demandées : celles de `prompt_ids`, ou, avec
+    `pending=True`, toutes celles qui n'ont pas encore été publiées (colonnes G et H vides).
+    Renvoie ({prompt_id: ligne de 11 colonnes}, [prompt_ids introuvables]).
+    """
+    sheet = _get_sheet(client, sheet_id)
+    sheet.reload()
+    if pending:
+        # La ligne 1 contient les en-têtes.
+        prompt_ids = [row[0] for row in sheet.rows[1:] if row[0] and not row[COL_VIDEO_URL - 1] and not row[COL_VIDEO_URL]]
+    rows = {prompt_id: sheet.row(sheet.row_of[prompt_id]) for prompt_id in prompt_ids if prompt_id in sheet.row_of}
+    return rows, [prompt_id for prompt_id in prompt_ids if prompt_id not in rows]
 
 def update_video_url_in_sheet(client: gspread.Client, sheet_id: str, prompt_id: str, video_url: str):
-    """Met à jour la ligne du prompt avec l'URL de la vidéo et le statut."""
-    sheet = client.open_by_key(sheet_id).sheet1
-    cell = sheet.find(prompt_id, in_column=1)
-    if not cell:
-        raise ValueError(f"Prompt avec l'ID '{prompt_id}' non trouvé.")
-    
-    sheet.update_cell(cell.row, 7, video_url) # Colonne G pour l'URL
-    sheet.update_cell(cell.row, 8, "Publié")  # Colonne H pour le statut
-    print(f"✅ Google Sheet mis à jour pour le prompt {prompt_id}.")
+    """
+    Met à jour la ligne du prompt avec l'URL de la vidéo et le statut, en un seul batch_update,
+    après avoir vérifié dans la colonne A que le prompt est toujours sur cette ligne.
+    """
+    sheet = _get_sheet(client, sheet_id)
+    number = sheet.current_row_number(prompt_id)
+    values = [video_url, "Publié"]
+    # raw=False : valeurs interprétées comme une saisie utilisateur, comme le faisait update_cell.
+    sheet.worksheet.batch_update([{"range": f"G{number}:H{number}", "values": [values]}], raw=False)
+    sheet.set_cells(number, COL_VIDEO_URL, values)
+    log.info(f"✅ Google Sheet mis à jour pour le prompt {prompt_id}.", extra={"prompt_id": prompt_id})
+
+@lru_cache(maxsize=1)
+def _youtube_discovery_document() -> str:
+    """
+    Document de découverte YouTube v3 livré avec google-api-python-client, gardé en texte JSON :
+    build_from_document modifie en place le dict qu'il reçoit, chaque client parse donc sa copie
+    (bien moins cher qu'un deepcopy du dict).
+    """
+    doc = get_static_doc('youtube', 'v3')
+    if not doc or not YOUTUBE_API_ROOT_URL:
+        return doc
+    document = json.loads(doc)
+    # Les uploads partent de rootUrl (`api_endpoint` ne concerne que les appels non-média).
+    root = YOUTUBE_API_ROOT_URL.rstrip("/") + "/"
+    document.update(rootUrl=root, baseUrl=root + document["servicePath"])
+    return json.dumps(document)
 
-def upload_to_youtube(access_token: str, video_path: str, title: str, description: str, tags: list[str], visibility: str = 'private'):
-    """Uploade une vidéo sur YouTube avec la visibilité spécifiée."""
+def get_youtube_client(access_token: str):
+    """
+    Service YouTube construit à partir du document de découverte en cache.
+    Le service lui-même n'est pas partagé : son transport httplib2 n'est pas thread-safe.
+    """
     creds = Credentials(token=access_token, scopes=SCOPES_YOUTUBE)
-    youtube = build('youtube', 'v3', credentials=creds)
+    document = _youtube_discovery_document()
+    if not document:
+        client_options = {"api_endpoint": YOUTUBE_API_ROOT_URL} if YOUTUBE_API_ROOT_URL else None
+        return build('youtube', 'v3', credentials=creds, client_options=client_options)
+    return build_from_document(document, credentials=creds)
+
+def upload_to_youtube(access_token: str, video_path: str, title: str, description: str, tags: list[str], visibility: str = 'private',
+                      resumable_uri: str = None, on_progress=None):
+    """
+    Uploade une vidéo sur YouTube avec la visibilité spécifiée, par morceaux de
+    YOUTUBE_UPLOAD_CHUNK_SIZE. Si `resumable_uri` est fourni, reprend la session
+    d'upload existante là où YouTube l'a laissée. `on_progress(resumable_uri,
+    octets_envoyés, taille_totale)` est appelé après chaque morceau.
+    """
+    youtube = get_youtube_client(access_token)
 
     valid_visibilities = ['private', 'public', 'unlisted']
     safe_visibility = visibility.lower() if visibility.lower() in valid_visibilities else 'private'
@@ -55,14 +267,35 @@ def upload_to_youtube(access_token: str, video_path: str, title: str, descriptio
         'status': {'privacyStatus': safe_visibility}
     }
     
-    media = MediaFileUpload(video_path, chunksize=-1, resumable=True)
+    media = MediaFileUpload(video_path, chunksize=YOUTUBE_UPLOAD_CHUNK_SIZE, resumable=True)
     request = youtube.videos().insert(part=','.join(body.keys()), body=body, media_body=media)
+    if resumable_uri:
+        # Le premier next_chunk() demandera alors à YouTube combien d'octets il a déjà reçus.
+        request.resumable_uri = resumable_uri
+        request._in_error_state = True
+
+    response = None
+    failures = 0
+    while response is None:
+        try:
+            # Pas de num_retries : googleapiclient renverrait le morceau depuis un flux déjà lu
+            # (corps vide, la requête reste bloquée jusqu'au timeout). Après une erreur, le
+            # next_chunk() suivant redemande à YouTube l'octet atteint et repart de là.
+            _, response = request.next_chunk(num_retries=0)
+            failures = 0
+        except HttpError as e:
+            failures += 1
+            if (e.resp.status != 429 and e.resp.status < 500) or failures > YOUTUBE_CHUNK_RETRIES:
+                raise
+            time.sleep(random.uniform(0, 2 ** failures))
+            continue
+        if on_progress:
+            on_progress(request.resumable_uri, media.size() if response else request.resumable_progress, media.size())
 
-    response = request.execute()
     video_id = response.get('id')
     if not video_id:
         raise IOError("Impossible de récupérer l'ID de la vidéo après l'upload.")
         
     video_url = f"https://www.youtube.com/watch?v={video_id}"
-    print(f"🚀 Vidéo uploadée avec succès sur YouTube ({safe_visibility}) : {video_url}")
+    log.info(f"🚀 Vidéo uploadée avec succès sur YouTube ({safe_visibility}) : {video_url}")
     return video_url
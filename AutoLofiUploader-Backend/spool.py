@@ -0,0 +1,28 @@
+# spool.py (répertoire unique pour tous les fichiers temporaires du service)
+
+import os
+
+# Tous les médias temporaires (audio, images, vidéos reçues...) vivent ici, pour que
+# le reaper (voir reaper.py) puisse les retrouver d'un seul parcours de répertoire.
+SPOOL_DIR = os.environ.get("SPOOL_DIR", "/tmp/autolofi")
+
+
+def spool_path(filename: str) -> str:
+    """Renvoie le chemin d'un fichier dans le spool (le répertoire est créé au besoin)."""
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return os.path.join(SPOOL_DIR, os.path.basename(filename))
+
+
+def remove_files(*paths) -> int:
+    """Supprime les fichiers existants parmi `paths` et renvoie le nombre d'octets libérés."""
+    freed = 0
+    for path in paths:
+        if not path:
+            continue
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            freed += size
+        except FileNotFoundError:
+            pass
+    return freed
@@ -0,0 +1,326 @@
+# task_store.py (stockage des tâches partagé entre les workers gunicorn)
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# --- Configuration ---
+# "sqlite:///chemin/vers/base.db" (défaut), "memory://" (un seul worker) ou "redis://hote:port/0".
+TASK_STORE_URL = os.environ.get("TASK_STORE_URL", "sqlite:////tmp/autolofi_tasks.db")
+
+
+class TaskStore:
+    """
+    Interface commune des stockages de tâches. S'utilise comme un dict
+    (`store[task_id]`, `in`, `get`, `pop`) et ajoute :
+      - une insertion atomique `put_if_absent`, pour dédoublonner ;
+      - un index secondaire suno_task_id -> task_id (`find_by_suno_id`), alimenté
+        par la clé "suno_task_id" des enregistrements et conservé jusqu'au `pop` ;
+      - des transitions de statut atomiques (`transition`), pour qu'un seul
+        worker puisse « réclamer » une tâche.
+    Les enregistrements sont des dicts sérialisables en JSON ; `get` renvoie une copie.
+    """
+
+    def get(self, task_id: str, default=None):
+        raise NotImplementedError
+
+    def put(self, task_id: str, task: dict):
+        raise NotImplementedError
+
+    def pop(self, task_id: str, default=None):
+        raise NotImplementedError
+
+    def put_if_absent(self, task_id: str, task: dict) -> bool:
+        """Enregistre `task` seulement si `task_id` n'existe pas encore ; renvoie True si c'est le cas."""
+        raise NotImplementedError
+
+    def find_by_suno_id(self, suno_task_id: str):
+        raise NotImplementedError
+
+    def transition(self, task_id: str, from_statuses, task: dict) -> bool:
+        """Remplace l'enregistrement par `task` seulement si son statut actuel est dans `from_statuses`."""
+        raise NotImplementedError
+
+    def items(self):
+        """Renvoie la liste des (task_id, enregistrement, date de dernière mise à jour)."""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __getitem__(self, task_id):
+        task = self.get(task_id)
+        if task is None:
+            raise KeyError(task_id)
+        return task
+
+    def __setitem__(self, task_id, task):
+        self.put(task_id, task)
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+
+class MemoryTaskStore(TaskStore):
+    """Stockage en mémoire (un seul processus), protégé par un verrou."""
+
+    def __init__(self):
+        self._tasks = {}
+        self._suno_index = {}
+        self._suno_by_task = {}
+        self._updated_at = {}
+        self._lock = threading.RLock()
+
+    def get(self, task_id, default=None):
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return json.loads(json.dumps(task)) if task is not None else default
+
+    def _put(self, task_id, task):
+        self._tasks[task_id] = json.loads(json.dumps(task))
+        self._updated_at[task_id] = time.time()
+        if task.get("suno_task_id"):
+            self._suno_index[task["suno_task_id"]] = task_id
+            self._suno_by_task[task_id] = task["suno_task_id"]
+
+    def put(self, task_id, task):
+        with self._lock:
+            self._put(task_id, task)
+
+    def put_if_absent(self, task_id, task):
+        with self._lock:
+            if task_id in self._tasks:
+                return False
+            self._put(task_id, task)
+            return True
+
+    def pop(self, task_id, default=None):
+        with self._lock:
+            task = self._tasks.pop(task_id, None)
+            if task is None:
+                return default
+            self._updated_at.pop(task_id, None)
+            suno_task_id = self._suno_by_task.pop(task_id, None)
+            if suno_task_id is not None:
+                self._suno_index.pop(suno_task_id, None)
+            return task
+
+    def find_by_suno_id(self, suno_task_id):
+        with self._lock:
+            return self._suno_index.get(suno_task_id)
+
+    def transition(self, task_id, from_statuses, task):
+        with self._lock:
+            current = self._tasks.get(task_id)
+            if current is None or current.get("status") not in from_statuses:
+                return False
+            self._put(task_id, task)
+            return True
+
+    def items(self):
+        with self._lock:
+            return [(task_id, json.loads(json.dumps(task)), self._updated_at[task_id])
+                    for task_id, task in self._tasks.items()]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tasks)
+
+
+class SqliteTaskStore(TaskStore):
+    """
+    Stockage SQLite en mode WAL, partagé par tous les workers d'une même machine.
+    Une connexion par thread (et par processus, pour survivre au fork de gunicorn).
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            namespace    TEXT NOT NULL,
+            task_id      TEXT NOT NULL,
+            status       TEXT,
+            suno_task_id TEXT,
+            data         TEXT NOT NULL,
+            created_at   REAL NOT NULL,
+            updated_at   REAL NOT NULL,
+            PRIMARY KEY (namespace, task_id)
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS tasks_by_suno_id
+            ON tasks (namespace, suno_task_id) WHERE suno_task_id IS NOT NULL;
+    """
+
+    def __init__(self, path: str, namespace: str):
+        self.path = path
+        self.namespace = namespace
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self._SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, task_id, default=None):
+        row = self._connect().execute(
+            "SELECT data FROM tasks WHERE namespace = ? AND task_id = ?", (self.namespace, task_id)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def put(self, task_id, task):
+        now = time.time()
+        self._connect().execute(
+            """INSERT INTO tasks (namespace, task_id, status, suno_task_id, data, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (namespace, task_id) DO UPDATE SET
+                   status = excluded.status,
+                   suno_task_id = COALESCE(excluded.suno_task_id, tasks.suno_task_id),
+                   data = excluded.data,
+                   updated_at = excluded.updated_at""",
+            (self.namespace, task_id, task.get("status"), task.get("suno_task_id"), json.dumps(task), now, now))
+
+    def put_if_absent(self, task_id, task):
+        now = time.time()
+        cursor = self._connect().execute(
+            """INSERT INTO tasks (namespace, task_id, status, suno_task_id, data, created_at, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (namespace, task_id) DO NOTHING""",
+            (self.namespace, task_id, task.get("status"), task.get("suno_task_id"), json.dumps(task), now, now))
+        return cursor.rowcount == 1
+
+    def pop(self, task_id, default=None):
+        row = self._connect().execute(
+            "DELETE FROM tasks WHERE namespace = ? AND task_id = ? RETURNING data", (self.namespace, task_id)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def find_by_suno_id(self, suno_task_id):
+        row = self._connect().execute(
+            "SELECT task_id FROM tasks WHERE namespace = ? AND suno_task_id = ?", (self.namespace, suno_task_id)).fetchone()
+        return row[0] if row else None
+
+    def transition(self, task_id, from_statuses, task):
+        from_statuses = tuple(from_statuses)
+        placeholders = ", ".join("?" * len(from_statuses))
+        cursor = self._connect().execute(
+            f"""UPDATE tasks SET status = ?, suno_task_id = COALESCE(?, suno_task_id), data = ?, updated_at = ?
+                WHERE namespace = ? AND task_id = ? AND status IN ({placeholders})""",
+            (task.get("status"), task.get("suno_task_id"), json.dumps(task), time.time(),
+             self.namespace, task_id, *from_statuses))
+        return cursor.rowcount == 1
+
+    def items(self):
+        rows = self._connect().execute(
+            "SELECT task_id, data, updated_at FROM tasks WHERE namespace = ?", (self.namespace,)).fetchall()
+        return [(task_id, json.loads(data), updated_at) for task_id, data, updated_at in rows]
+
+    def __len__(self):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM tasks WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+
+
+class RedisTaskStore(TaskStore):
+    """
+    Stockage Redis (ou tout serveur compatible : Valkey, KeyDB...). Nécessite le
+    paquet optionnel `redis`. Chaque tâche est un hash ; l'index Suno est un hash unique.
+    """
+
+    # Transition atomique : KEYS[1] = tâche, KEYS[2] = index Suno ;
+    # ARGV = statut, suno_id, data, now, task_id, puis les statuts de départ autorisés.
+    _TRANSITION_SCRIPT = """
+        local current = redis.call('HGET', KEYS[1], 'status')
+        if not current then return 0 end
+        for i = 6, #ARGV do
+            if current == ARGV[i] then
+                redis.call('HSET', KEYS[1], 'status', ARGV[1], 'data', ARGV[3], 'updated_at', ARGV[4])
+                if ARGV[2] ~= '' then
+                    redis.call('HSET', KEYS[1], 'suno_task_id', ARGV[2])
+                    redis.call('HSET', KEYS[2], ARGV[2], ARGV[5])
+                end
+                return 1
+            end
+        end
+        return 0
+    """
+
+    def __init__(self, url: str, namespace: str):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("TASK_STORE_URL pointe vers Redis mais le paquet 'redis' n'est pas installé.") from e
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self.namespace = namespace
+        self._index_key = f"autolofi:{namespace}:suno_index"
+        self._count_key = f"autolofi:{namespace}:tasks"
+        self._transition = self._redis.register_script(self._TRANSITION_SCRIPT)
+
+    def _key(self, task_id):
+        return f"autolofi:{self.namespace}:task:{task_id}"
+
+    def get(self, task_id, default=None):
+        data = self._redis.hget(self._key(task_id), "data")
+        return json.loads(data) if data else default
+
+    def put(self, task_id, task):
+        now = time.time()
+        key = self._key(task_id)
+        pipe = self._redis.pipeline()
+        pipe.hsetnx(key, "created_at", now)
+        pipe.hset(key, mapping={"status": task.get("status") or "", "data": json.dumps(task), "updated_at": now})
+        pipe.sadd(self._count_key, task_id)
+        if task.get("suno_task_id"):
+            pipe.hset(key, "suno_task_id", task["suno_task_id"])
+            pipe.hset(self._index_key, task["suno_task_id"], task_id)
+        pipe.execute()
+
+    def put_if_absent(self, task_id, task):
+        # HSETNX est atomique : seul le premier appelant crée la clé, puis la remplit.
+        if not self._redis.hsetnx(self._key(task_id), "created_at", time.time()):
+            return False
+        self.put(task_id, task)
+        return True
+
+    def pop(self, task_id, default=None):
+        key = self._key(task_id)
+        data, suno_task_id = self._redis.hmget(key, "data", "suno_task_id")
+        pipe = self._redis.pipeline()
+        pipe.delete(key)
+        pipe.srem(self._count_key, task_id)
+        if suno_task_id:
+            pipe.hdel(self._index_key, suno_task_id)
+        pipe.execute()
+        return json.loads(data) if data else default
+
+    def find_by_suno_id(self, suno_task_id):
+        return self._redis.hget(self._index_key, suno_task_id)
+
+    def transition(self, task_id, from_statuses, task):
+        return bool(self._transition(
+            keys=[self._key(task_id), self._index_key],
+            args=[task.get("status") or "", task.get("suno_task_id") or "", json.dumps(task), time.time(), task_id,
+                  *from_statuses]))
+
+    def items(self):
+        task_ids = list(self._redis.smembers(self._count_key))
+        pipe = self._redis.pipeline()
+        for task_id in task_ids:
+            pipe.hmget(self._key(task_id), "data", "updated_at")
+        return [(task_id, json.loads(data), float(updated_at))
+                for task_id, (data, updated_at) in zip(task_ids, pipe.execute()) if data]
+
+    def __len__(self):
+        return self._redis.scard(self._count_key)
+
+
+def open_task_store(namespace: str, url: str = TASK_STORE_URL) -> TaskStore:
+    """Ouvre le stockage décrit par `url` pour l'espace de noms donné ("v1", "v2"...)."""
+    if url.startswith("memory://"):
+        return MemoryTaskStore()
+    if url.startswith("sqlite:///"):
+        return SqliteTaskStore(url[len("sqlite:///"):], namespace)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisTaskStore(url, namespace)
+    raise ValueError(f"TASK_STORE_URL non supportée : '{url}'.")
@@ -0,0 +1,142 @@
+# workers.py (pool de tâches de fond pour les callbacks)
+
+import os
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import logs
+
+log = logs.get_logger("workers")
+
+# --- Configuration (surchargeable via les variables d'environnement) ---
+WORKER_POOL_KIND = os.environ.get("WORKER_POOL_KIND", "thread")   # "thread" ou "process"
+WORKER_POOL_SIZE = int(os.environ.get("WORKER_POOL_SIZE", "4"))    # Téléchargements simultanés
+WORKER_QUEUE_MAX = int(os.environ.get("WORKER_QUEUE_MAX", "16"))   # Travaux en attente au-delà du pool
+WORKER_RETRY_AFTER = int(os.environ.get("WORKER_RETRY_AFTER", "30"))  # Secondes conseillées à Suno en cas de saturation
+
+
+class QueueFullError(RuntimeError):
+    """Levée quand le pool et sa file d'attente sont pleins (backpressure)."""
+
+
+class StageTimer:
+    """Mesure la durée (en secondes) de chaque étape d'un travail."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round(time.perf_counter() - start, 3)
+
+
+def _run_job(fn, submitted_at: float, args: tuple, trace_id=None):
+    """Exécute `fn` dans le pool et renvoie son résultat avec le temps d'attente et d'exécution."""
+    started_at = time.time()
+    with logs.trace(trace_id):  # Le trace_id de la requête suit le travail (thread ou processus)
+        result = fn(*args)
+    return result, {"queue_wait": round(started_at - submitted_at, 3),
+                    "run": round(time.time() - started_at, 3)}
+
+
+class WorkerPool:
+    """
+    Pool borné de travaux de fond. `submit` ne bloque jamais : si `size + queue_max`
+    travaux sont déjà en cours ou en attente, il lève QueueFullError.
+    Les callbacks `on_done` / `on_error` s'exécutent toujours dans le processus
+    parent, ce qui permet de mettre à jour les stockages en mémoire même avec un
+    pool de processus (les fonctions soumises doivent alors être picklables).
+    """
+
+    def __init__(self, kind: str = WORKER_POOL_KIND, size: int = WORKER_POOL_SIZE, queue_max: int = WORKER_QUEUE_MAX):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"WORKER_POOL_KIND invalide : '{kind}' (attendu : 'thread' ou 'process').")
+        self.kind = kind
+        self.size = size
+        self.capacity = size + queue_max
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._executor = None
+
+    def _get_executor(self):
+        # Création paresseuse : chaque worker gunicorn (après fork) obtient son propre pool.
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    # forkserver, pas fork : un fork du worker gunicorn copierait ses sockets clients
+                    # (la connexion resterait ouverte côté client) et les verrous tenus par ses autres threads.
+                    self._executor = ProcessPoolExecutor(max_workers=self.size,
+                                                         mp_context=multiprocessing.get_context("forkserver"))
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="callback-worker")
+            return self._executor
+
+    def _reset_executor(self, broken):
+        """Abandonne un pool de processus dont un enfant est mort (OOM...) : le suivant sera neuf."""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+        log.warning("Un processus du pool de fond s'est arrêté brutalement ; le pool est recréé.")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        if not self._slots.acquire(blocking=False):
+            raise QueueFullError(f"File de travaux pleine ({self.capacity} travaux en cours ou en attente).")
+        with self._lock:
+            self._in_flight += 1
+        try:
+            trace_id = logs.current_trace_id()
+            executor = self._get_executor()
+            try:
+                future = executor.submit(_run_job, fn, time.time(), args, trace_id)
+            except BrokenProcessPool:
+                self._reset_executor(executor)
+                executor = self._get_executor()
+                future = executor.submit(_run_job, fn, time.time(), args, trace_id)
+        except Exception:
+            self._release()
+            raise
+
+        def _finished(fut):
+            try:
+                with logs.trace(trace_id):
+                    error = fut.exception()
+                    if isinstance(error, BrokenProcessPool):
+                        # Les travaux en cours sont perdus avec le pool : ils passent en erreur, les suivants iront au pool neuf.
+                        self._reset_executor(executor)
+                        error = RuntimeError("Le processus qui exécutait ce travail s'est arrêté brutalement "
+                                             "(mémoire insuffisante ?). Relancez la génération.")
+                    if error is None:
+                        result, timings = fut.result()
+                        if on_done: on_done(result, timings)
+                    elif on_error:
+                        on_error(error)
+            except Exception:
+                log.exception("Échec d'un callback on_done/on_error du pool.")
+            finally:
+                self._release()
+
+        future.add_done_callback(_finished)
+        return future
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+
+POOL = WorkerPool()
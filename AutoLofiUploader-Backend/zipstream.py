@@ -0,0 +1,101 @@
+# zipstream.py (archive ZIP « virtuelle » envoyée en streaming, sans fichier intermédiaire)
+
+import os
+import time
+import zlib
+import struct
+import hashlib
+
+READ_CHUNK_SIZE = int(os.environ.get("ZIP_READ_CHUNK_SIZE", str(256 * 1024)))
+_ZIP32_LIMIT = 0xFFFFFFFF
+
+
+def file_crc32(path: str, chunk_size: int = READ_CHUNK_SIZE) -> int:
+    """CRC-32 d'un fichier, lu par blocs."""
+    crc = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _dos_datetime(timestamp: float):
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:  # Le format DOS commence le 1er janvier 1980
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 4) | t.tm_mday
+
+
+class StoredZip:
+    """
+    Archive ZIP en mode ZIP_STORED décrite comme une suite de segments : en-têtes
+    (bytes construits à l'avance) et contenus lus directement depuis les fichiers
+    sources. La taille totale est connue avant le premier octet, rien n'est écrit
+    sur disque et le contenu est déterministe pour des fichiers donnés : `etag` l'identifie
+    et `iter_range` permet de reprendre un téléchargement interrompu (requêtes HTTP Range).
+
+    `entries` : liste de (nom dans l'archive, chemin du fichier ou bytes).
+    `crcs` : CRC-32 déjà connus, par nom dans l'archive (sinon calculés à la lecture des fichiers).
+    """
+
+    def __init__(self, entries, crcs=None):
+        crcs = crcs or {}
+        self._segments = []  # bytes, ou (chemin, taille)
+        central_directory = []
+        offset = 0
+        for arcname, source in entries:
+            name = arcname.encode("utf-8")
+            if isinstance(source, (bytes, bytearray)):
+                size, crc, mtime = len(source), zlib.crc32(source), 0
+            else:
+                st = os.stat(source)
+                size, mtime = st.st_size, st.st_mtime
+                crc = crcs.get(arcname)
+                if crc is None:
+                    crc = file_crc32(source)
+            if size > _ZIP32_LIMIT or offset > _ZIP32_LIMIT:
+                raise ValueError(f"'{arcname}' dépasse la limite de 4 Go du format ZIP sans Zip64.")
+            dos_time, dos_date = _dos_datetime(mtime)
+            local_header = struct.pack("<IHHHHHIIIHH", 0x04034B50, 20, 0x0800, 0, dos_time, dos_date,
+                                       crc, size, size, len(name), 0) + name
+            central_directory.append(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, 20, 20, 0x0800, 0,
+                                                 dos_time, dos_date, crc, size, size, len(name), 0, 0, 0, 0,
+                                                 0o100644 << 16, offset) + name)
+            self._segments.append(local_header)
+            self._segments.append(bytes(source) if isinstance(source, (bytes, bytearray)) else (source, size))
+            offset += len(local_header) + size
+
+        central = b"".join(central_directory)
+        end_record = struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(entries), len(entries), len(central), offset, 0)
+        self._segments.append(central + end_record)
+        self.size = offset + len(central) + len(end_record)
+        # Le répertoire central contient noms, tailles, dates et CRC de chaque entrée.
+        self.etag = hashlib.sha1(central + end_record).hexdigest()
+
+    def iter_bytes(self, chunk_size: int = READ_CHUNK_SIZE):
+        """Génère le contenu de l'archive, bloc par bloc."""
+        return self.iter_range(0, self.size, chunk_size)
+
+    def iter_range(self, start: int, stop: int, chunk_size: int = READ_CHUNK_SIZE):
+        """Génère les octets [start, stop) de l'archive, sans lire les parties des fichiers hors de l'intervalle."""
+        segment_start = 0
+        for segment in self._segments:
+            length = len(segment) if isinstance(segment, bytes) else segment[1]
+            # Intervalle demandé, relatif au début du segment
+            begin, end = max(start, segment_start) - segment_start, min(stop, segment_start + length) - segment_start
+            segment_start += length
+            if begin >= end:
+                continue
+            if isinstance(segment, bytes):
+                yield segment[begin:end]
+                continue
+            path, _ = segment
+            with open(path, "rb") as f:
+                f.seek(begin)
+                remaining = end - begin
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    if not chunk:
+                        raise IOError(f"Fichier tronqué pendant l'envoi de l'archive : {path}")
+                    remaining -= len(chunk)
+                    yield chunk